@@ -0,0 +1,262 @@
+"""Monte Carlo balancing: seeded bots play the game rules headless on every core.
+
+    python balance.py --runs 20000
+    python balance.py --runs 5000 --bots novice,average --endless --max-seconds 300
+    python balance.py --runs 5000 --set PLAYER_SPEED=300 --set CUBE_GAP=70 --json out.json
+
+Each run is a GameState driven by a Bot for one policy and seed. No window,
+sound or fonts are involved. Runs are shared out in chunks over a
+ProcessPoolExecutor. A chunk comes back as compact per-run tuples, and the
+parent turns those into win rates, score percentiles and per-level
+accuracy and time-to-answer.
+
+--set NAME=VALUE overrides a main.py setting in every worker before it
+runs, e.g. PLAYER_SPEED, JUMP_VELOCITY, LEVEL_TIME, COMBO_RESET_TIME,
+CUBE_GAP. Only settings read while the game runs are affected. Those baked
+into a default argument at import time, such as WRONG_ANSWERS, are not.
+"""
+import argparse
+import ast
+import json
+import os
+import random
+import statistics
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # once per worker otherwise
+
+import main
+
+CHUNK_RUNS = 50  # runs per task sent to a worker
+CUBE_REACH = 8  # bots jump once the player's centre is this close to the aim point
+
+# accuracy: chance of going for the right cube (None picks any cube at random)
+# reaction: seconds after the level intro before the bot starts moving, drawn uniformly
+# aim: largest horizontal miss in pixels when lining up under a cube
+# hold: seconds the jump key is held
+Policy = namedtuple("Policy", "accuracy reaction_min reaction_max aim hold")
+POLICIES = {
+    "expert": Policy(0.95, 0.8, 2.5, 6, 0.25),
+    "average": Policy(0.8, 1.5, 6.0, 12, 0.1),
+    "novice": Policy(0.6, 3.0, 15.0, 20, 0.05),
+    "random": Policy(None, 0.5, 3.0, 12, 0.1),
+}
+
+# One finished run: answers is a tuple of (level, correct, seconds); correct is None for a timeout
+RunResult = namedtuple("RunResult", "policy seed won score levels time best_combo answers")
+
+
+class Bot:
+    def __init__(self, policy, rng):
+        self.policy = policy
+        self.rng = rng
+        self.cubes = None
+        self.target = None
+        self.offset = 0.0
+        self.ready_at = None
+        self.jumped_at = None
+
+    def plan(self, state):
+        # New level (or the same one again after losing a life): pick a cube
+        p = self.policy
+        self.cubes = state.cubes
+        correct = [c for c in state.cubes if c.correct]
+        wrong = [c for c in state.cubes if not c.correct]
+        if p.accuracy is None:
+            self.target = self.rng.choice(state.cubes)
+        elif correct and (not wrong or self.rng.random() < p.accuracy):
+            self.target = correct[0]
+        else:
+            self.target = self.rng.choice(wrong)
+        self.offset = self.rng.uniform(-p.aim, p.aim)
+        self.ready_at = None
+
+    def inputs(self, state):
+        if state.cubes is not self.cubes:
+            self.plan(state)
+        if state.show_level_intro or state.finished:
+            return main.NO_INPUT
+        if self.ready_at is None:
+            self.ready_at = state.time + self.rng.uniform(self.policy.reaction_min,
+                                                         self.policy.reaction_max)
+        if state.time < self.ready_at:
+            return main.NO_INPUT
+
+        player = state.player
+        release = self.jumped_at is not None and state.time - self.jumped_at >= self.policy.hold
+        if release:
+            self.jumped_at = None
+        dx = self.target.rect.centerx + self.offset - player.rect.centerx
+        jump = abs(dx) < CUBE_REACH and player.on_ground
+        if jump:
+            self.jumped_at = state.time
+        return main.Inputs(dx < -2, dx > 2, jump, release)
+
+
+def run_one(policy_name, seed, endless=False, max_seconds=600.0):
+    dt = main.SIM_DT
+    state = main.GameState(seed=seed, endless=endless)
+    bot = Bot(POLICIES[policy_name], random.Random(seed * 7919 + 17))
+    answers = []
+    while not state.finished and state.time < max_seconds:
+        inputs = bot.inputs(state)
+        state.begin_step(dt)
+        state.update_player(inputs, dt)
+        state.update_world(dt)
+        # The level being answered, before a correct answer moves on
+        level = state.current_level + 1
+        answer_time = main.LEVEL_TIME - state.timer
+        state.check_collisions()
+        state.update_intro(dt)
+        for ev in state.events:
+            if ev.kind in ("correct", "wrong"):
+                answers.append((level, ev.kind == "correct", round(answer_time, 3)))
+            elif ev.kind == "timeout":
+                answers.append((level, None, main.LEVEL_TIME))
+    return RunResult(policy_name, seed, state.win, state.score, state.current_level,
+                     round(state.time, 3), state.best_combo, tuple(answers))
+
+
+def _init_worker(overrides):
+    for name, value in overrides.items():
+        setattr(main, name, value)
+
+
+def run_chunk(task):
+    policy_name, first_seed, count, endless, max_seconds = task
+    return [tuple(run_one(policy_name, seed, endless, max_seconds))
+            for seed in range(first_seed, first_seed + count)]
+
+
+def run_many(runs, policies, seed=1, endless=False, max_seconds=600.0, workers=None,
+             overrides=None):
+    overrides = overrides or {}
+    tasks = []
+    for policy_name in policies:
+        for start in range(0, runs, CHUNK_RUNS):
+            tasks.append((policy_name, seed + start, min(CHUNK_RUNS, runs - start), endless,
+                          max_seconds))
+    results = []
+    if workers == 1:
+        _init_worker(overrides)
+        for task in tasks:
+            results.extend(run_chunk(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(overrides,)) as pool:
+            for chunk in pool.map(run_chunk, tasks):
+                results.extend(chunk)
+    return [RunResult(*r) for r in results]
+
+
+def percentiles(samples, cuts=(10, 50, 90)):
+    if not samples:
+        return {f"p{c}": 0.0 for c in cuts}
+    if len(samples) == 1:
+        return {f"p{c}": float(samples[0]) for c in cuts}
+    q = statistics.quantiles(samples, n=100, method="inclusive")  # stays within min..max
+    return {f"p{c}": q[c - 1] for c in cuts}
+
+
+def aggregate(results):
+    by_policy = defaultdict(list)
+    for r in results:
+        by_policy[r.policy].append(r)
+    report = {}
+    for policy_name, runs in by_policy.items():
+        levels = defaultdict(lambda: {"reached": 0, "correct": 0, "wrong": 0, "timeouts": 0,
+                                      "times": []})
+        for r in runs:
+            for level in range(1, r.levels + (0 if r.won else 1) + 1):
+                levels[level]["reached"] += 1
+            for level, correct, seconds in r.answers:
+                row = levels[level]
+                if correct is None:
+                    row["timeouts"] += 1
+                else:
+                    row["correct" if correct else "wrong"] += 1
+                    row["times"].append(seconds)
+        scores = [r.score for r in runs]
+        report[policy_name] = {
+            "runs": len(runs),
+            "win_rate": sum(r.won for r in runs) / len(runs),
+            "score": dict(percentiles(scores), mean=statistics.fmean(scores)),
+            "levels_cleared": statistics.fmean(r.levels for r in runs),
+            "session_seconds": statistics.fmean(r.time for r in runs),
+            "levels": {
+                level: {
+                    "reached": row["reached"],
+                    "accuracy": row["correct"] / max(1, row["correct"] + row["wrong"]),
+                    "timeouts": row["timeouts"],
+                    "time_to_answer": percentiles(row["times"], (50, 90)),
+                }
+                for level, row in sorted(levels.items())
+            },
+        }
+    return report
+
+
+def print_report(report, max_levels=12):
+    for policy_name, r in report.items():
+        s = r["score"]
+        print(f"{policy_name}: {r['runs']} runs, win rate {r['win_rate']:.1%}, "
+              f"levels cleared {r['levels_cleared']:.2f}, session {r['session_seconds']:.1f}s")
+        print(f"  score p10 {s['p10']:.0f}  p50 {s['p50']:.0f}  p90 {s['p90']:.0f}  mean {s['mean']:.1f}")
+        print(f"  {'level':>5}{'reached':>9}{'accuracy':>10}{'timeouts':>10}{'p50 s':>8}{'p90 s':>8}")
+        for level, row in list(r["levels"].items())[:max_levels]:
+            t = row["time_to_answer"]
+            print(f"  {level:>5}{row['reached']:>9}{row['accuracy']:>10.1%}{row['timeouts']:>10}"
+                  f"{t['p50']:>8.2f}{t['p90']:>8.2f}")
+
+
+def parse_override(text):
+    name, sep, value = text.partition("=")
+    if not sep or not name.isupper() or not hasattr(main, name):
+        raise argparse.ArgumentTypeError(f"expected SETTING=VALUE for a main.py setting, got {text!r}")
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        raise argparse.ArgumentTypeError(f"{name}: {value!r} is not a Python literal")
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=2000, help="runs per bot policy")
+    parser.add_argument("--bots", default="expert,average,novice",
+                        help=f"comma-separated policies from {', '.join(POLICIES)}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--endless", action="store_true")
+    parser.add_argument("--max-seconds", type=float, default=600.0,
+                        help="simulated seconds before a run is cut off")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--set", dest="overrides", type=parse_override, action="append", default=[],
+                        metavar="SETTING=VALUE")
+    parser.add_argument("--json", metavar="PATH", help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    policies = [p.strip() for p in args.bots.split(",") if p.strip()]
+    unknown = [p for p in policies if p not in POLICIES]
+    if unknown:
+        parser.error(f"unknown bot policy {', '.join(unknown)}")
+
+    start = time.perf_counter()
+    results = run_many(args.runs, policies, args.seed, args.endless, args.max_seconds,
+                       args.workers, dict(args.overrides))
+    elapsed = time.perf_counter() - start
+    report = aggregate(results)
+    print_report(report)
+    simulated = sum(r.time for r in results)
+    print(f"{len(results)} runs in {elapsed:.1f}s ({len(results) / elapsed:.0f} runs/s, "
+          f"{simulated / elapsed:.0f}x real time)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": dict(args.overrides), "endless": args.endless, "policies": report},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
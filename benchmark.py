@@ -0,0 +1,299 @@
+"""Benchmarks for Math Runner.
+
+    python benchmark.py sim --steps 200000 --seed 1
+    python benchmark.py frames --frames 3000 --seed 1 --json frames.json
+    python benchmark.py frames --window 1920x1080 --integer-scale
+    python benchmark.py frames --replay replays/session.mrr
+    python benchmark.py frames --replay replays/session.mrr --bank questions.qbank --topic fractions
+
+`sim` runs the game rules (GameState.step) headless with scripted input and
+reports how many simulation steps per second this machine manages.
+
+`frames` plays a scripted session through the full game frame (input, rules,
+effects and drawing) on the dummy video driver and reports p50/p95/p99 times
+for each phase, followed by a second pass under tracemalloc that measures
+what each frame allocates. With --replay the input comes from a recorded
+session (see replay.py) instead of the script, looping when it ends. A
+session played from a question bank needs the same bank and topic, passed
+with --bank and --topic. Pass --json to write the results to a file so two
+runs can be compared.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+# No window, no sound card, no frame cap
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import main
+import replay as replay_format
+from questions import QuestionBank
+
+
+def scripted_inputs(seed):
+    # Endless deterministic input: hold a direction for a while, jump now and then
+    rng = random.Random(seed)
+    left = right = False
+    hold = 0
+    while True:
+        if hold <= 0:
+            direction = rng.choice((-1, 0, 1, 1))
+            left, right = direction < 0, direction > 0
+            hold = rng.randint(10, 60)
+        hold -= 1
+        jump = rng.random() < 0.04
+        yield main.Inputs(left, right, jump, not jump and rng.random() < 0.1)
+
+
+def run_sim(steps, seed, dt=main.SIM_DT):
+    inputs = scripted_inputs(seed)
+    session_seed = seed
+    state = main.GameState(seed=session_seed)
+    sessions = 1
+    start = time.perf_counter()
+    for _ in range(steps):
+        if state.finished:
+            session_seed += 1
+            sessions += 1
+            state = main.GameState(seed=session_seed)
+        state.step(next(inputs), dt)
+    elapsed = time.perf_counter() - start
+    return {
+        "steps": steps,
+        "sessions": sessions,
+        "seconds": elapsed,
+        "steps_per_second": steps / elapsed if elapsed else float("inf"),
+        "simulated_seconds": steps * dt,
+    }
+
+
+FRAME_PHASES = main.DEBUG_PHASES
+
+
+class FrameRunner:
+    # Drives the same work as one game_loop tick, phase by phase, from scripted input.
+    # Each frame is dt long and runs as many SIM_DT steps as game_loop would.
+    def __init__(self, seed, dt=1.0 / main.FPS, window=None, integer_scale=main.INTEGER_SCALE,
+                 replay=None, bank=None, topic=None):
+        if replay is not None and replay.question_bank and bank is None:
+            raise ValueError("replay was recorded with a question bank; pass the same bank")
+        random.seed(seed)
+        self.seed = seed
+        self.dt = dt
+        self.acc = 0.0
+        self.replay = replay
+        self.bank = bank
+        self.topic = topic
+        self.replay_inputs = replay_format.decode_table(main.Inputs)
+        self.tick = 0
+        self.inputs = scripted_inputs(seed)
+        main.init_pygame()
+        self.screen = main.DISPLAY.open(window, fullscreen=False, integer_scale=integer_scale,
+                                        sdl_scaling=False)
+        if not main.ASSETS.done:
+            main.ASSETS.load()
+        main.AUDIO.setup(main.ASSETS.sounds)
+        self.background = main.Background()
+        self.new_session()
+
+    def new_session(self):
+        if self.replay is not None:
+            self.state = main.GameState(seed=self.replay.seed, endless=self.replay.endless,
+                                        bank=self.bank if self.replay.question_bank else None,
+                                        topic=self.topic)
+            self.tick = 0
+        else:
+            self.state = main.GameState(seed=self.seed)
+        self.view = main.GameView(self.background, seed=self.seed)
+        self.seed += 1
+
+    def frame(self, times=None):
+        clock = time.perf_counter
+        sim_dt = main.SIM_DT
+        state, view = self.state, self.view
+        t0 = clock()
+        main.pygame.event.get()
+        inputs = next(self.inputs)
+        t1 = clock()
+        self.acc += self.dt
+        player_t = world_t = collision_t = 0.0
+        game_events = []
+        while self.acc >= sim_dt:
+            if self.replay is not None and self.tick < len(self.replay):
+                inputs = self.replay_inputs[self.replay.masks[self.tick]]
+                self.tick += 1
+            s0 = clock()
+            state.begin_step(sim_dt)
+            state.update_player(inputs, sim_dt)
+            s1 = clock()
+            state.update_world(sim_dt)
+            s2 = clock()
+            state.check_collisions()
+            state.update_intro(sim_dt)
+            s3 = clock()
+            player_t += s1 - s0
+            world_t += s2 - s1
+            collision_t += s3 - s2
+            game_events.extend(state.events)
+            self.acc -= sim_dt
+            # A key press only counts once
+            inputs = inputs._replace(jump=False, release_jump=False)
+        t2 = t1 + player_t
+        t3 = t2 + world_t
+        t4 = clock()
+        view.handle_events(game_events)
+        view.update(state, self.dt)
+        t5 = clock()
+        view.draw_background(self.screen)
+        t6 = clock()
+        view.draw_entities(self.screen, state, self.acc / sim_dt)
+        t7 = clock()
+        view.draw_hud(self.screen, state)
+        t8 = clock()
+        view.draw_overlays(self.screen, state)
+        t9 = clock()
+        main.DISPLAY.flip()
+        t10 = clock()
+        if times is not None:
+            stamps = (t0, t1, t2, t3, t4, t5, t6, t7, t8, t9, t10)
+            for i, phase in enumerate(FRAME_PHASES):
+                times[phase].append(stamps[i + 1] - stamps[i])
+            times["frame"].append(t10 - t0)
+        if self.replay is not None:
+            if self.tick >= len(self.replay):
+                self.new_session()
+        elif state.finished and state.time > 3.0:
+            # Leave the overlay up for a moment, then start the next scripted session
+            self.new_session()
+
+
+def percentiles(samples, scale=1.0):
+    if len(samples) < 2:
+        cuts = [samples[0] if samples else 0.0] * 99
+    else:
+        cuts = statistics.quantiles(samples, n=100, method="inclusive")  # stays within min..max
+    return {
+        "p50": cuts[49] * scale,
+        "p95": cuts[94] * scale,
+        "p99": cuts[98] * scale,
+        "mean": statistics.fmean(samples) * scale if samples else 0.0,
+        "max": max(samples) * scale if samples else 0.0,
+    }
+
+
+def run_frames(frames, seed, alloc_frames=None, warmup=60, window=None, integer_scale=False,
+               replay=None, bank=None, topic=None):
+    runner = FrameRunner(seed, window=window, integer_scale=integer_scale, replay=replay,
+                         bank=bank, topic=topic)
+    for _ in range(warmup):
+        runner.frame()
+
+    times = {phase: [] for phase in FRAME_PHASES + ("frame",)}
+    for _ in range(frames):
+        runner.frame(times)
+    timing = {phase: percentiles(samples, 1000) for phase, samples in times.items()}
+
+    # tracemalloc slows everything down, so allocations get their own pass
+    alloc_frames = alloc_frames if alloc_frames is not None else min(frames, 600)
+    peak_bytes, net_bytes, net_blocks = [], [], []
+    tracemalloc.start()
+    before_snapshot = tracemalloc.take_snapshot()
+    for _ in range(alloc_frames):
+        tracemalloc.reset_peak()
+        blocks_before = sys.getallocatedblocks()
+        current_before = tracemalloc.get_traced_memory()[0]
+        runner.frame()
+        current, peak = tracemalloc.get_traced_memory()
+        peak_bytes.append(peak - current_before)
+        net_bytes.append(current - current_before)
+        net_blocks.append(sys.getallocatedblocks() - blocks_before)
+    after_snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    # Leave out tracemalloc itself and this file's own sample lists
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    growth = after_snapshot.filter_traces(filters).compare_to(
+        before_snapshot.filter_traces(filters), "lineno")
+    top_sites = [
+        {"site": str(stat.traceback), "count_diff": stat.count_diff, "size_diff": stat.size_diff}
+        for stat in growth[:10] if stat.count_diff > 0
+    ]
+
+    return {
+        "seed": seed,
+        "frames": frames,
+        "window": list(main.DISPLAY.window.get_size()),
+        "timing_ms": timing,
+        "allocations": {
+            "frames": alloc_frames,
+            "peak_bytes_per_frame": percentiles(peak_bytes),
+            "net_bytes_per_frame": percentiles(net_bytes),
+            "net_blocks_per_frame": percentiles(net_blocks),
+            "retained_by_site": top_sites,
+        },
+        "text_cache_hit_rate": main.TEXT_CACHE.hit_rate(),
+    }
+
+
+def print_frames(r):
+    print(f"{r['frames']} frames, seed {r['seed']}, window {r['window'][0]}x{r['window'][1]}")
+    print(f"{'phase':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for phase, t in r["timing_ms"].items():
+        print(f"{phase:<12}{t['p50']:>10.3f}{t['p95']:>10.3f}{t['p99']:>10.3f}")
+    alloc = r["allocations"]
+    peak = alloc["peak_bytes_per_frame"]
+    blocks = alloc["net_blocks_per_frame"]
+    print(f"allocated per frame: p50 {peak['p50']:.0f} B, p99 {peak['p99']:.0f} B, "
+          f"max {peak['max']:.0f} B; net blocks p99 {blocks['p99']:.0f}")
+    for site in alloc["retained_by_site"]:
+        print(f"  +{site['count_diff']} blocks ({site['size_diff']} B) {site['site']}")
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sim = sub.add_parser("sim", help="headless GameState.step throughput")
+    sim.add_argument("--steps", type=int, default=100_000)
+    sim.add_argument("--seed", type=int, default=1)
+
+    frames = sub.add_parser("frames", help="per-phase frame times and allocations")
+    frames.add_argument("--frames", type=int, default=3000)
+    frames.add_argument("--alloc-frames", type=int, default=None,
+                        help="frames to run under tracemalloc (default: min(frames, 600))")
+    frames.add_argument("--seed", type=int, default=1)
+    frames.add_argument("--window", metavar="WxH", help="window size, scaled from the logical size")
+    frames.add_argument("--integer-scale", action="store_true")
+    frames.add_argument("--replay", metavar="PATH", help="take input from a recorded session")
+    frames.add_argument("--bank", metavar="PATH", help="question bank the replay was played with")
+    frames.add_argument("--topic")
+    frames.add_argument("--json", metavar="PATH", help="write results as JSON")
+
+    args = parser.parse_args(argv)
+    if args.command == "sim":
+        r = run_sim(args.steps, args.seed)
+        print(f"{r['steps']} steps in {r['seconds']:.2f}s over {r['sessions']} sessions")
+        print(f"{r['steps_per_second']:.0f} steps/s "
+              f"({r['simulated_seconds'] / r['seconds']:.0f}x real time)")
+    elif args.command == "frames":
+        window = tuple(int(n) for n in args.window.split("x")) if args.window else None
+        replay = replay_format.Replay.load(args.replay) if args.replay else None
+        if replay is not None and replay.question_bank and not args.bank:
+            parser.error(f"{args.replay} was recorded with a question bank; pass it with --bank")
+        bank = QuestionBank(args.bank) if args.bank else None
+        r = run_frames(args.frames, args.seed, args.alloc_frames, window=window,
+                       integer_scale=args.integer_scale, replay=replay, bank=bank, topic=args.topic)
+        print_frames(r)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(r, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
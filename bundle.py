@@ -0,0 +1,144 @@
+"""Packed asset bundle: one file with pre-decoded pixels and PCM audio.
+
+    python bundle.py build assets.bundle
+
+Layout: an 8-byte magic, a little-endian u32 with the JSON index length, the
+JSON index, then the data section, which starts on a BLOB_ALIGN boundary.
+Each blob also starts on a BLOB_ALIGN boundary. The index maps asset name ->
+{"kind", "offset", "size", ...}, with offsets counted from the data section:
+
+  image  width, height and format, at the source size. Images with
+         per-pixel alpha are stored as BGRA and opaque ones as RGBX.
+  sound  PCM in the mixer format recorded in the index (frequency, size,
+         channels). If the runtime mixer differs, the original file is decoded.
+  raw    the file's bytes unchanged, used for the streamed background music.
+
+At runtime the bundle is memory-mapped copy-on-write. What it saves is the
+file I/O and the PNG/MP3 decoding at startup. Images are created with
+pygame.image.frombuffer over the mapping without a copy, but that only
+covers the first read. The game then scales, converts or blits every image
+into its own display-format surfaces (parallax layers, the baked ground,
+animation frames), so those pixels live in ordinary memory like the loose
+files' do.
+"""
+import argparse
+import io
+import json
+import mmap
+import os
+import struct
+
+import pygame
+
+MAGIC = b"MRBNDL01"
+BLOB_ALIGN = 64
+HEADER = struct.Struct("<8sI")
+
+
+def _align(n):
+    return (n + BLOB_ALIGN - 1) // BLOB_ALIGN * BLOB_ALIGN
+
+
+def build_bundle(out_path, images, sounds, music=None):
+    # images: name -> path, sounds: name -> path, music: path or None
+    # Needs pygame.mixer initialised with the game's mixer settings
+    blobs = []
+    index = {}
+
+    for name, path in images.items():
+        surf = pygame.image.load(path)
+        has_alpha = bool(surf.get_flags() & pygame.SRCALPHA)
+        fmt = "BGRA" if has_alpha else "RGBX"
+        data = pygame.image.tobytes(surf, fmt)
+        index[name] = {"kind": "image", "source": path, "width": surf.get_width(),
+                       "height": surf.get_height(), "format": fmt}
+        blobs.append((name, data))
+
+    frequency, size, channels = pygame.mixer.get_init()
+    for name, path in sounds.items():
+        data = pygame.mixer.Sound(path).get_raw()
+        index[name] = {"kind": "sound", "source": path, "frequency": frequency,
+                       "bits": size, "channels": channels}
+        blobs.append((name, data))
+
+    if music is not None:
+        with open(music, "rb") as f:
+            index["music"] = {"kind": "raw", "source": music, "namehint": os.path.splitext(music)[1][1:]}
+            blobs.append(("music", f.read()))
+
+    # Offsets are relative to the data section, which starts after the index
+    offset = 0
+    for name, data in blobs:
+        index[name]["offset"] = offset
+        index[name]["size"] = len(data)
+        offset = _align(offset + len(data))
+    index_bytes = json.dumps(index, sort_keys=True).encode()
+    data_start = _align(HEADER.size + len(index_bytes))
+
+    with open(out_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(index_bytes)))
+        f.write(index_bytes)
+        for name, data in blobs:
+            f.seek(data_start + index[name]["offset"])
+            f.write(data)
+    return index
+
+
+class Bundle:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            # ACCESS_COPY: pages stay shared until something writes to a surface
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, index_len = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an asset bundle")
+        self.index = json.loads(bytes(self.map[HEADER.size:HEADER.size + index_len]))
+        self.data_start = _align(HEADER.size + index_len)
+        self.view = memoryview(self.map)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def blob(self, name):
+        entry = self.index[name]
+        start = self.data_start + entry["offset"]
+        return self.view[start:start + entry["size"]]
+
+    def image(self, name):
+        entry = self.index[name]
+        return pygame.image.frombuffer(self.blob(name), (entry["width"], entry["height"]),
+                                       entry["format"])
+
+    def sound(self, name):
+        entry = self.index[name]
+        if pygame.mixer.get_init() != (entry["frequency"], entry["bits"], entry["channels"]):
+            # Stored PCM would play at the wrong speed/pitch on this mixer
+            return pygame.mixer.Sound(entry["source"])
+        return pygame.mixer.Sound(buffer=self.blob(name))
+
+    def music_file(self, name="music"):
+        entry = self.index[name]
+        return io.BytesIO(self.blob(name)), entry["namehint"]
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="pack the game's assets into a bundle")
+    build.add_argument("out", nargs="?", default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        import main
+        pygame.mixer.init()
+        out = args.out or main.BUNDLE_PATH
+        index = build_bundle(out, main.Assets.IMAGES,
+                             {name: path for name, (path, _) in main.Assets.SOUNDS.items()},
+                             main.Assets.MUSIC[0])
+        print(f"{out}: {len(index)} assets, {os.path.getsize(out) / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -3,18 +3,60 @@ import random
 import sys
 import math
 import os
+import threading
+import time
+from itertools import islice
+from collections import OrderedDict, deque, namedtuple
+
+import numpy as np
+
+from bundle import Bundle
+from profiler import FrameProfiler, SampleWriter
+from questions import QuestionBank
+from replay import ReplayRecorder
+from scores import HighscoreRepository
+from telemetry import TelemetryLog
 
 # ----- Settings -----
 WIDTH, HEIGHT = 800, 450
 FPS = 60
-
-GRAVITY = 0.6
-JUMP_VELOCITY = -15
+RENDER_FPS = FPS  # render cap; 0 draws as fast as the display allows
+# Screens that are not changing (menu, game over, minimised window) sleep in
+# pygame.event.wait instead of redrawing
+IDLE_WAIT_MS = 500  # longest a static screen sleeps before checking again
+UNFOCUSED_FPS = 10  # render cap while another window has focus
+# Run the simulation on its own thread and draw from the frames it publishes
+# (see SimulationThread); MATH_RUNNER_PIPELINE=1 turns it on too
+PIPELINED = False
+
+# Simulation runs in fixed steps, independent of the render rate
+SIM_HZ = 120
+SIM_DT = 1.0 / SIM_HZ
+MAX_FRAME_TIME = 0.25  # longest frame caught up on; anything slower slows the game down
+
+# Physics, in pixels and seconds. The jump was tuned as a per-frame step at
+# 60 FPS that moved in whole pixels (0.6 gravity, -15 jump, half lift); these
+# values give the same apex within 2 px and air time within a frame, at every
+# hold length, on the fixed step
+GRAVITY = 33 * 60
+JUMP_VELOCITY = -828
+JUMP_HOLD_LIFT = 0.52  # share of gravity cancelled while jump is held
 GROUND_HEIGHT = 32
-PLAYER_SPEED = 4
+PLAYER_SPEED = 4 * 60
+PLAYER_START_X = 120
+PLAYER_FRAMES = ("player0", "player1", "player2", "player3")  # idle cycle; the first is also the jump frame
 
 CUBE_W = 72
 CUBE_H = 72
+CUBE_GAP = 50  # cube bottoms float CUBE_H + CUBE_GAP above the ground
+CUBE_FLOAT_AMP = 18
+CUBE_FLOAT_SPEED = 1.6
+CUBE_FLASH_ALPHA = 200
+CUBE_FLASH_DECAY = 12 * 60  # flash alpha lost per second
+CUBE_FLASH_STEPS = 8  # pre-blended flash frames per cube sprite
+CUBE_COLORKEY = (255, 0, 255)  # transparent colour of the flat (low quality) cube sprite
+CUBE_MIN_GAP = 24  # narrowest gap between neighbouring answer cubes
+MAX_ANSWER_CUBES = WIDTH // (CUBE_W + CUBE_MIN_GAP) - 1  # answers that fit across the screen
 COIN_W = 36
 COIN_H = 36
 
@@ -25,9 +67,51 @@ SCORE_COIN = 5
 MAX_LIVES = 3
 LEVEL_TIME = 30  # seconds per level
 
+# Levels
+WRONG_ANSWERS = 3  # distractor cubes per level
+LEVEL_PREFETCH = 4  # upcoming levels generated ahead of time
+ENDLESS_OPERATORS = "+-*/"
+LEVELS_PER_DIFFICULTY = 3  # endless mode gets harder every this many levels
+MAX_DIFFICULTY = 10
+
+# Collision
+GRID_CELL = 64  # broad-phase grid cell size in pixels
+
+# Groups with fewer floating entities than this bob with math.sin; numpy's
+# per-call overhead only pays off for larger groups
+BOBBING_BATCH_MIN = 24
+
 # Combo
 COMBO_RESET_TIME = 3.0  # seconds without correct hit to reset combo
 
+# Parallax background
+SKY_HEIGHT = 750  # sky is stretched taller than the screen, only the top is visible
+CLOUD_Y = 70
+SKY_SPEED = 0.2 * 60  # pixels per second
+CLOUD_SPEED = 0.4 * 60
+FAR_GROUND_SPEED = 0.8 * 60
+GROUND_TILE_OVERLAP = 8  # pixels each platform tile overlaps the previous one
+PARALLAX_SCROLL = True
+
+# Rendering
+# Push only the regions that changed with display.update(rects) instead of
+# flipping the whole window. Frames where the parallax layers scroll or an
+# overlay covers the screen still flip, so this pays off with PARALLAX_SCROLL off.
+DIRTY_RECT_RENDERING = False
+# The game is laid out and drawn at WIDTH x HEIGHT and scaled to the window
+# once per frame, so a bigger window or fullscreen costs no extra blits.
+WINDOW_SIZE = None  # real window size, None for WIDTH x HEIGHT
+FULLSCREEN = False
+INTEGER_SCALE = False  # scale by whole multiples only and letterbox the rest (crisp pixel art)
+SDL_SCALING = False  # let SDL's renderer upscale (pygame.SCALED) instead of transform.scale
+# Effects are dropped a step at a time (QUALITY_LEVELS) while frames run over
+# the 60 FPS budget, and come back once there is headroom again
+ADAPTIVE_QUALITY = True
+QUALITY_WINDOW = 30  # frames measured per decision
+QUALITY_UP_RATIO = 0.6  # frames this far under budget count as headroom
+QUALITY_UP_WINDOWS = 4  # windows of headroom in a row before stepping back up
+QUALITY_MAX_UP_WINDOWS = 64  # longest that wait gets after step-ups that didn't hold
+
 # Colors
 BG = (30, 30, 40)
 PLAYER_COLOR = (240, 230, 140)
@@ -40,80 +124,496 @@ CORRECT_COLOR = (80, 220, 100)
 WRONG_COLOR = (220, 80, 80)
 PUFF_COLOR = (200, 200, 200)
 
-pygame.init()
-pygame.font.init()
-
-# fonts
-FONT_BIG = pygame.font.SysFont(None, 64)
-FONT_MED = pygame.font.SysFont(None, 36)
-FONT_SMALL = pygame.font.SysFont(None, 24)
+# Particles
+PARTICLE_CAPACITY = 512
+PUFF_MAX_RADIUS = 32
+PUFF_ALPHA_STEP = 16  # alpha levels in the pre-rendered puff atlas
+JUMP_PUFFS = 12
+LANDING_PUFFS = 8
+LANDING_MIN_SPEED = 4 * 60  # fall speed needed before landing kicks up dust
+HIT_PUFFS = 24
+
+# Audio
+AUDIO_CHANNELS = 12  # mixer channels reserved for the AudioManager's pool
+SOUND_LIMITS = {  # sound -> (max simultaneous voices, seconds before it may start again)
+    "jump": (2, 0.08),
+    "walk": (1, 0.0),
+    "score": (3, 0.05),
+    "game_over": (1, 1.0),
+}
+
+# Text rendering
+TEXT_CACHE_SIZE = 256  # rendered strings kept before the least recently used is dropped
+FLOAT_TEXT_ALPHA_STEP = 16  # fade is quantised so faded frames come from the cache
+
+# Fonts, created by init_pygame() so importing this module has no side effects
+FONT_BIG = None
+FONT_MED = None
+FONT_SMALL = None
 
-pygame.mixer.init()
-
-pygame.mixer.music.load("bg_music.mp3")  
-pygame.mixer.music.set_volume(0.3)  
-pygame.mixer.music.play(-1)  
+BASE_DIR = os.path.dirname(__file__)
+# Built by `python bundle.py build`; loose files are used when it's missing
+BUNDLE_PATH = "assets.bundle"
+# Built by `python questions.py build`; the built-in levels are used when it's missing
+QUESTION_BANK_PATH = "questions.qbank"
+BANK_LEVELS = 10  # questions in a levels-mode game drawn from the bank
+# Finished sessions are saved here (see scores.py)
+SCORES_PATH = "scores.db"
+
+# ----- Display -----
+class Display:
+    # Owns the window. Everything draws to `surface` at the logical size; flip()
+    # and update(rects) scale it into the window. Until open() is called these
+    # fall straight through to pygame.display.
+    def __init__(self):
+        self.window = None
+        self.surface = None
+        self.scale = 1  # logical -> window pixels
+        self.dest = None  # where the logical frame lands in the window
+        self.target = None  # window subsurface at dest, when software scaling
+
+    def open(self, size=WINDOW_SIZE, fullscreen=FULLSCREEN, integer_scale=INTEGER_SCALE,
+             sdl_scaling=SDL_SCALING):
+        logical = (WIDTH, HEIGHT)
+        flags = pygame.FULLSCREEN if fullscreen else 0
+        size = size or logical
+        self.target = None
+        if sdl_scaling and (fullscreen or tuple(size) != logical):
+            # SDL picks the window size and scales on the GPU: whole multiples
+            # in a window, filling the screen (letterboxed) in fullscreen
+            self.window = self.surface = pygame.display.set_mode(logical, flags | pygame.SCALED)
+            self.scale = 1
+            self.dest = self.window.get_rect()
+            return self.surface
+
+        self.window = pygame.display.set_mode((0, 0) if fullscreen else size, flags)
+        win_w, win_h = self.window.get_size()
+        self.scale = min(win_w / WIDTH, win_h / HEIGHT)
+        if integer_scale and self.scale >= 1:
+            # Smaller than the logical size has no whole multiple: keep the fractional scale
+            self.scale = int(self.scale)
+        self.dest = pygame.Rect(0, 0, round(WIDTH * self.scale), round(HEIGHT * self.scale))
+        self.dest.center = self.window.get_rect().center
+        if self.dest.size == logical and self.dest.topleft == (0, 0):
+            # Window is the logical size: draw straight into it
+            self.surface = self.window
+        else:
+            self.window.fill((0, 0, 0))  # letterbox bars, never drawn over
+            self.surface = pygame.Surface(logical).convert(self.window)
+            self.target = self.window.subsurface(self.dest.clip(self.window.get_rect()))
+        return self.surface
+
+    def flip(self):
+        if self.target is not None:
+            pygame.transform.scale(self.surface, self.target.get_size(), self.target)
+        pygame.display.flip()
 
-jump_sfx = pygame.mixer.Sound("jump.mp3")
-walk_sfx = pygame.mixer.Sound("walk.mp3")
-score_sfx = pygame.mixer.Sound("coin.mp3")
-game_over_sfx = pygame.mixer.Sound("gameover.mp3")
+    def update(self, rects):
+        if self.target is None:
+            pygame.display.update(rects)
+        elif isinstance(self.scale, int):
+            # Whole multiples map pixel for pixel, so only the changed regions are scaled
+            k = self.scale
+            # Only the part of the frame that lands inside the target
+            target_w, target_h = self.target.get_size()
+            frame = self.surface.get_rect().clip(pygame.Rect(0, 0, target_w // k, target_h // k))
+            out = []
+            for r in rects:
+                r = frame.clip(r)
+                if not r:
+                    continue
+                area = pygame.Rect(r.x * k, r.y * k, r.w * k, r.h * k)
+                pygame.transform.scale(self.surface.subsurface(r), area.size,
+                                       self.target.subsurface(area))
+                out.append(area.move(self.dest.topleft))
+            pygame.display.update(out)
+        else:
+            # Fractional scales would leave seams between regions
+            self.flip()
+
+
+DISPLAY = Display()
+
+# ----- Assets -----
+# Process start, so startup timings are measured from the moment Python got here
+STARTUP_T0 = time.perf_counter()
+
+
+def init_pygame(audio=True):
+    global FONT_BIG, FONT_MED, FONT_SMALL
+    pygame.init()
+    pygame.font.init()
+    # Font(None) is what SysFont(None) resolves to, without scanning the system fonts first
+    FONT_BIG = pygame.font.Font(None, 64)
+    FONT_MED = pygame.font.Font(None, 36)
+    FONT_SMALL = pygame.font.Font(None, 24)
+    if audio:
+        pygame.mixer.init()
+
+
+class Assets:
+    # Images and sounds, decoded by load() (from a worker thread in main())
+    IMAGES = {
+        "sky": "sky.png",
+        "far_ground": "far-grounds.png",
+        "ground_tile": "platform1.png",
+        "cloud": "clouds.png",
+        "player0": "tile000.png",
+        "player1": "tile001.png",
+        "player2": "tile002.png",
+        "player3": "tile003.png",
+    }
+    SOUNDS = {
+        "jump": ("jump.mp3", 0.4),
+        "walk": ("walk.mp3", 0.9),
+        "score": ("coin.mp3", 0.7),
+        "game_over": ("gameover.mp3", 0.6),
+    }
+    MUSIC = ("bg_music.mp3", 0.3)
+
+    def __init__(self, bundle_path=BUNDLE_PATH):
+        self.bundle_path = bundle_path
+        self.bundle = None
+        self.images = {}
+        self.sounds = {}
+        self.total = len(self.IMAGES) + len(self.SOUNDS)
+        self.loaded = 0
+        self.done = False
+        self.error = None
+        self.timings = {}  # file -> seconds spent loading it
+        self.thread = None
+
+    @property
+    def progress(self):
+        return self.loaded / self.total
+
+    def load(self, audio=True):
+        if self.bundle_path and os.path.exists(self.bundle_path):
+            self.bundle = Bundle(self.bundle_path)
+        bundle = self.bundle
+        for name, path in self.IMAGES.items():
+            t = time.perf_counter()
+            if bundle is not None and name in bundle:
+                self.images[name] = bundle.image(name)
+            else:
+                self.images[name] = pygame.image.load(path)
+            self.timings[path] = time.perf_counter() - t
+            self.loaded += 1
+        for name, (path, volume) in self.SOUNDS.items():
+            if audio:
+                t = time.perf_counter()
+                if bundle is not None and name in bundle:
+                    sound = bundle.sound(name)
+                else:
+                    sound = pygame.mixer.Sound(path)
+                sound.set_volume(volume)
+                self.sounds[name] = sound
+                self.timings[path] = time.perf_counter() - t
+            self.loaded += 1
+        self.done = True
+
+    def start(self, audio=True):
+        self.thread = threading.Thread(target=self._load_in_thread, args=(audio,),
+                                       name="asset-loader", daemon=True)
+        self.thread.start()
+
+    def _load_in_thread(self, audio):
+        try:
+            self.load(audio)
+        except Exception as e:
+            self.error = e
+            self.done = True
+
+    def play_music(self):
+        path, volume = self.MUSIC
+        if self.bundle is not None and "music" in self.bundle:
+            pygame.mixer.music.load(*self.bundle.music_file())
+        else:
+            pygame.mixer.music.load(path)
+        pygame.mixer.music.set_volume(volume)
+        pygame.mixer.music.play(-1)
+
+
+ASSETS = Assets()
+
+
+class AudioManager:
+    # Owns a reserved pool of mixer channels. play() only queues a request;
+    # flush() runs once per frame, merges repeats of the same sound and
+    # applies each sound's voice limit and cooldown before anything starts
+    def __init__(self, limits=SOUND_LIMITS):
+        self.limits = limits
+        self.sounds = {}
+        self.channels = []
+        self.voices = {}  # sound name -> channels it was started on
+        self.last_start = {}  # sound name -> time it last started
+        self.pending = {}  # sound name -> requests this frame
+        self.stats = dict.fromkeys(("requested", "played", "merged", "cooldown",
+                                    "voice_limit", "no_channel"), 0)
+        self.peak_busy = 0
+
+    def setup(self, sounds, channels=AUDIO_CHANNELS):
+        self.sounds = sounds
+        if pygame.mixer.get_init() is None:
+            return
+        if pygame.mixer.get_num_channels() < channels:
+            pygame.mixer.set_num_channels(channels)
+        # Reserved channels are never picked by a bare Sound.play()
+        pygame.mixer.set_reserved(channels)
+        self.channels = [pygame.mixer.Channel(i) for i in range(channels)]
+
+    def play(self, name):
+        self.stats["requested"] += 1
+        if name in self.pending:
+            self.stats["merged"] += 1
+        self.pending[name] = self.pending.get(name, 0) + 1
+
+    def flush(self, now=None):
+        if not self.pending:
+            return
+        now = time.perf_counter() if now is None else now
+        for name in self.pending:
+            sound = self.sounds.get(name)
+            if sound is None or not self.channels:
+                continue
+            max_voices, cooldown = self.limits.get(name, (1, 0.0))
+            if now - self.last_start.get(name, -cooldown) < cooldown:
+                self.stats["cooldown"] += 1
+                continue
+            voices = [ch for ch in self.voices.get(name, ()) if ch.get_sound() is sound]
+            if len(voices) >= max_voices:
+                self.voices[name] = voices
+                self.stats["voice_limit"] += 1
+                continue
+            channel = self._free_channel()
+            if channel is None:
+                self.stats["no_channel"] += 1
+                continue
+            channel.play(sound)
+            voices.append(channel)
+            self.voices[name] = voices
+            self.last_start[name] = now
+            self.stats["played"] += 1
+        self.pending.clear()
+        self.peak_busy = max(self.peak_busy, self.busy())
+
+    def _free_channel(self):
+        for channel in self.channels:
+            if not channel.get_busy():
+                return channel
+        return None
+
+    def busy(self):
+        return sum(1 for channel in self.channels if channel.get_busy())
+
+    def load(self):
+        # Share of the pool currently playing
+        return self.busy() / len(self.channels) if self.channels else 0.0
+
+    def stop(self):
+        for channel in self.channels:
+            channel.stop()
+        self.pending.clear()
+
+
+AUDIO = AudioManager()
+
+
+def loading_screen(screen, clock, assets):
+    # Keeps the window alive and shows progress until the loader thread finishes
+    while not assets.done:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+        screen.fill(BG)
+        draw_text(screen, "Loading...", FONT_MED, WIDTH//2, HEIGHT//2 - 30, center=True)
+        bar = pygame.Rect(0, 0, WIDTH // 2, 16)
+        bar.center = (WIDTH//2, HEIGHT//2 + 10)
+        pygame.draw.rect(screen, TEXT_COLOR, bar, 1)
+        fill = bar.inflate(-4, -4)
+        fill.width = int(fill.width * assets.progress)
+        pygame.draw.rect(screen, HIGHLIGHT_COLOR, fill)
+        DISPLAY.flip()
+        clock.tick(30)
+    if assets.error is not None:
+        raise assets.error
+
+
+
+
+
+# ----- Parallax Background -----
+def to_display_format(image):
+    # Convert once to the display pixel format so blits don't convert every frame
+    if image.get_flags() & pygame.SRCALPHA:
+        return image.convert_alpha()
+    return image.convert()
+
+
+class ParallaxLayer:
+    def __init__(self, image, y, speed, size=None):
+        if size is not None and size != image.get_size():
+            image = pygame.transform.scale(image, size)
+        # Rows below the screen are never visible, don't keep them around
+        visible_h = min(image.get_height(), HEIGHT - y)
+        if visible_h < image.get_height():
+            image = image.subsurface((0, 0, image.get_width(), visible_h))
+        image = to_display_format(image)
+
+        self.tile_w = image.get_width()
+        self.h = image.get_height()
+        self.y = y
+        self.speed = speed
+        self.scroll = 0.0
 
-jump_sfx.set_volume(0.4)
-walk_sfx.set_volume(0.9)
-score_sfx.set_volume(0.7)
-game_over_sfx.set_volume(0.6)
+        # Pre-tile the layer so any scroll offset is covered by a single blit
+        copies = max(2, math.ceil((WIDTH + self.tile_w) / self.tile_w))
+        self.strip = pygame.Surface((self.tile_w * copies, self.h), image.get_flags(), image)
+        for i in range(copies):
+            self.strip.blit(image, (i * self.tile_w, 0))
+        self.area = pygame.Rect(0, 0, WIDTH, self.h)
 
+    def update(self, dt):
+        self.scroll = (self.scroll - self.speed * dt) % self.tile_w
+        self.area.x = int(self.scroll)
 
+    def draw(self, surf):
+        surf.blit(self.strip, (0, self.y), self.area)
+
+
+def bake_ground(tile, overlap=GROUND_TILE_OVERLAP):
+    tile_w, tile_h = tile.get_size()
+    ground = pygame.Surface((WIDTH, tile_h), pygame.SRCALPHA)
+    for x in range(0, WIDTH, tile_w - overlap):
+        ground.blit(tile, (x, 0))
+    return to_display_format(ground)
+
+
+class Background:
+    # Needs a display mode to be set, since layers are converted to its format
+    def __init__(self, scrolling=PARALLAX_SCROLL, images=None):
+        images = images if images is not None else ASSETS.images
+        sky, cloud, far_ground = images["sky"], images["cloud"], images["far_ground"]
+        far_ground_y = HEIGHT - GROUND_HEIGHT - far_ground.get_height()
+        self.layers = [
+            ParallaxLayer(sky, 0, SKY_SPEED, (WIDTH, SKY_HEIGHT)),
+            ParallaxLayer(cloud, CLOUD_Y, CLOUD_SPEED, (WIDTH, cloud.get_height())),
+            ParallaxLayer(far_ground, far_ground_y, FAR_GROUND_SPEED,
+                          (WIDTH, far_ground.get_height())),
+        ]
+        self.clouds = self.layers[1]
+        self.shown = self.layers
+        self.ground = bake_ground(images["ground_tile"])
+        self.ground_y = HEIGHT - self.ground.get_height()
+        self.parallax = scrolling
+        self.scrolling = scrolling
+        self.still = None  # whole background composed once, while it isn't scrolling
+
+    def set_detail(self, clouds=True, scrolling=True):
+        # Lower quality levels leave out the cloud layer and stop the scrolling
+        shown = self.layers if clouds else [l for l in self.layers if l is not self.clouds]
+        scrolling = self.parallax and scrolling
+        if shown != self.shown or scrolling != self.scrolling:
+            self.shown = shown
+            self.scrolling = scrolling
+            self.still = None
 
-BASE_DIR = os.path.dirname(__file__)
+    def update(self, dt):
+        if not self.scrolling:
+            return
+        for layer in self.shown:
+            layer.update(dt)
 
-SKY_BG = pygame.image.load("sky.png")
-FAR_GROUND = pygame.image.load("far-grounds.png")
-GROUND_TILE = pygame.image.load("platform1.png")
-CLOUD = pygame.image.load("clouds.png")
+    def compose(self, surf):
+        for layer in self.shown:
+            layer.draw(surf)
+        surf.blit(self.ground, (0, self.ground_y))
 
+    def draw(self, surf):
+        if self.scrolling:
+            self.compose(surf)
+        else:
+            # One opaque blit instead of a blit per layer
+            surf.blit(self.get_still(), (0, 0))
 
-print("All images loaded successfully!")
+    def get_still(self):
+        if self.still is None:
+            self.still = pygame.Surface((WIDTH, HEIGHT)).convert()
+            self.compose(self.still)
+        return self.still
 
+    def restore(self, surf, rect):
+        # Paint the background back over one region, for dirty-rect rendering
+        surf.blit(self.get_still(), rect, rect)
 
+# ----- Animation Helper -----
+class FrameSet:
+    # Scaled animation frames, plus the same frames mirrored for facing left
+    def __init__(self, frames):
+        self.right = tuple(frames)
+        self.left = tuple(pygame.transform.flip(f, True, False) for f in self.right)
+
+    def __len__(self):
+        return len(self.right)
+
+
+class AnimationRegistry:
+    # Process-wide cache: each set of frames is loaded, scaled and flipped
+    # once, however many players or animations use it
+    def __init__(self):
+        self.sets = {}
+
+    def images(self, names, scale=1.0):
+        # names: Assets.IMAGES keys (already decoded by the loader), or file paths
+        key = ("images", tuple(names), scale)
+        frames = self.sets.get(key)
+        if frames is None:
+            surfaces = []
+            for name in names:
+                image = ASSETS.images.get(name)
+                if image is None:
+                    image = pygame.image.load(Assets.IMAGES.get(name, name))
+                surfaces.append(self._scaled(image.convert_alpha(), scale))
+            frames = self.sets[key] = FrameSet(surfaces)
+        return frames
+
+    def sheet(self, path, frame_width, frame_height, frame_count, row=0, scale=1.0):
+        key = ("sheet", path, frame_width, frame_height, frame_count, row, scale)
+        frames = self.sets.get(key)
+        if frames is None:
+            sheet = pygame.image.load(path).convert_alpha()
+            frames = self.sets[key] = FrameSet(
+                self._scaled(sheet.subsurface((i * frame_width, row * frame_height,
+                                               frame_width, frame_height)), scale)
+                for i in range(frame_count))
+        return frames
+
+    @staticmethod
+    def _scaled(frame, scale):
+        if scale == 1.0:
+            return frame
+        return pygame.transform.scale(
+            frame, (int(frame.get_width() * scale), int(frame.get_height() * scale)))
+
+    def clear(self):
+        self.sets.clear()
+
+
+ANIMATIONS = AnimationRegistry()
 
 
-# ----- Animation Helper -----
 class Animation:
-    def __init__(self, image_paths=None, sprite_sheet=None, frame_width=16, frame_height=16,
-                 frame_count=1, frame_time=0.15, scale=1.0, row=0):
-        self.frames = []
+    # Playback position over a shared FrameSet; creating one loads nothing
+    def __init__(self, frames, frame_time=0.15):
+        self.frames = frames
         self.frame_time = frame_time
         self.current_time = 0.0
         self.current_frame = 0
-        self.scale = scale
-
-        if image_paths:
-            for path in image_paths:
-                frame = pygame.image.load(path).convert_alpha()
-                if scale != 1.0:
-                    frame = pygame.transform.scale(
-                        frame,
-                        (int(frame.get_width() * scale), int(frame.get_height() * scale))
-                    )
-                self.frames.append(frame)
-        elif sprite_sheet:
-            sheet = pygame.image.load(sprite_sheet).convert_alpha()
-            for i in range(frame_count):
-                frame_rect = pygame.Rect(
-                    i * frame_width,
-                    row * frame_height,
-                    frame_width,
-                    frame_height
-                )
-                frame = sheet.subsurface(frame_rect)
-                if scale != 1.0:
-                    frame = pygame.transform.scale(
-                        frame,
-                        (int(frame_width * scale), int(frame_height * scale))
-                    )
-                self.frames.append(frame)
+
+    def reset(self):
+        self.current_time = 0.0
+        self.current_frame = 0
 
     def update(self, dt):
         self.current_time += dt
@@ -121,8 +621,9 @@ class Animation:
             self.current_time = 0.0
             self.current_frame = (self.current_frame + 1) % len(self.frames)
 
-    def get_frame(self):
-        return self.frames[self.current_frame]
+    def get_frame(self, facing_right=True):
+        frames = self.frames.right if facing_right else self.frames.left
+        return frames[self.current_frame]
 
 # ----- Player Class -----
 class Player:
@@ -137,50 +638,75 @@ class Player:
         self.collision_h = int(self.display_h * 0.5)
 
         self.rect = pygame.Rect(x, ground_y - self.collision_h, self.display_w, self.collision_h)
+        self.ground_y = ground_y
+        self.max_jump_time = 0.25
+
+        # Animations are set up on first draw so the physics can run headless
+        self.animations = None
+        self.current_anim = None
+        self.reset(x)
+
+    def reset(self, x):
+        # Back to standing at x, ready for a new level; keeps the loaded animations
+        self.rect.topleft = (x, self.ground_y - self.collision_h)
+        # Exact position; rect is its whole-pixel copy for collisions
+        self.x = float(self.rect.x)
+        self.y = float(self.rect.y)
+        # Position before the last update, for interpolated drawing
+        self.prev_x = self.x
+        self.prev_y = self.y
         self.vel_y = 0.0
         self.on_ground = False
+        self.landing_speed = 0.0
         self.facing_right = True
-        self.ground_y = ground_y
 
         # Jump control
         self.holding_jump = False
-        self.max_jump_time = 0.25
         self.jump_time = 0.0
 
-        # Animations
+        self.walking = False
+        if self.animations is not None:
+            for anim in self.animations.values():
+                anim.reset()
+            self.current_anim = self.animations["idle"]
+
+    def load_animations(self):
+        idle = ANIMATIONS.images(PLAYER_FRAMES, self.scale_y)
         self.animations = {
-            "idle": Animation(image_paths=["tile000.png","tile001.png","tile002.png","tile003.png"],
-                              frame_time=0.2, scale=self.scale_y),
-            "jump": Animation(image_paths=["tile000.png"],
-                              frame_time=0.15, scale=self.scale_y)
+            "idle": Animation(idle, frame_time=0.2),
+            "jump": Animation(ANIMATIONS.images(PLAYER_FRAMES[:1], self.scale_y), frame_time=0.15),
         }
         self.current_anim = self.animations["idle"]
 
-    def update(self, keys, dt, speed_mult=1.0):
+    def update(self, inputs, dt, speed_mult=1.0):
+        self.prev_x = self.x
+        self.prev_y = self.y
+
         # Horizontal movement
-        if keys[pygame.K_LEFT] or keys[pygame.K_a]:
-            self.rect.x -= int(PLAYER_SPEED * speed_mult)
+        if inputs.left:
+            self.x -= PLAYER_SPEED * speed_mult * dt
             self.facing_right = False
-        if keys[pygame.K_RIGHT] or keys[pygame.K_d]:
-            self.rect.x += int(PLAYER_SPEED * speed_mult)
+        if inputs.right:
+            self.x += PLAYER_SPEED * speed_mult * dt
             self.facing_right = True
-        
-        if abs(self.vel_y) > 0 and self.on_ground:
-            if not pygame.mixer.Channel(1).get_busy():  
-                pygame.mixer.Channel(1).play(walk_sfx)
+
+        self.walking = abs(self.vel_y) > 0 and self.on_ground
 
         # Variable jump height
         if self.holding_jump and self.jump_time < self.max_jump_time:
-            self.vel_y += GRAVITY * -0.5
+            self.vel_y -= GRAVITY * JUMP_HOLD_LIFT * dt
             self.jump_time += dt
 
         # Apply gravity
-        self.vel_y += GRAVITY
-        self.rect.y += int(self.vel_y)
+        self.vel_y += GRAVITY * dt
+        self.y += self.vel_y * dt
 
         # Ground collision
-        if self.rect.bottom >= self.ground_y:
-            self.rect.bottom = self.ground_y
+        self.landing_speed = 0.0
+        if self.y + self.rect.height >= self.ground_y:
+            if not self.on_ground:
+                self.landing_speed = self.vel_y
+            self.y = float(self.ground_y - self.rect.height)
             self.vel_y = 0
             self.on_ground = True
             self.holding_jump = False
@@ -189,9 +715,13 @@ class Player:
             self.on_ground = False
 
         # Clamp horizontal
-        self.rect.x = max(0, min(WIDTH - self.rect.width, self.rect.x))
+        self.x = max(0.0, min(float(WIDTH - self.rect.width), self.x))
+        self.rect.x = int(self.x)
+        self.rect.y = int(self.y)
 
-        # Animation
+    def animate(self, dt):
+        if self.animations is None:
+            self.load_animations()
         if not self.on_ground:
             self.current_anim = self.animations["jump"]
         else:
@@ -210,38 +740,158 @@ class Player:
     def release_jump(self):
         self.holding_jump = False
 
-    def draw(self, surf):
-        frame = self.current_anim.get_frame()
-        if not self.facing_right:
-            frame = pygame.transform.flip(frame, True, False)
-        draw_y = self.rect.bottom - frame.get_height() + 8  # adjust +5 downwards
-        surf.blit(frame, (self.rect.x, draw_y))
-
-# ----- Puff, AnswerCube, Coin, FloatingText classes remain the same -----
-# (Copy them from your previous code; nothing changes for these)
-class Puff:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self.radius = 6
-        self.alpha = 220
-        self.vx = random.uniform(-0.6, 0.6)
-        self.vy = random.uniform(-1.2, -0.6)
-
-    def update(self):
-        self.x += self.vx
-        self.y += self.vy
-        self.radius += 0.6
-        self.alpha -= 6
-        return self.alpha > 0
+    def draw(self, surf, alpha=1.0):
+        # alpha: how far between the previous and the current simulation step to draw
+        if self.animations is None:
+            self.load_animations()
+        frame = self.current_anim.get_frame(self.facing_right)
+        x = int(self.prev_x + (self.x - self.prev_x) * alpha)
+        y = int(self.prev_y + (self.y - self.prev_y) * alpha)
+        draw_y = y + self.rect.height - frame.get_height() + 8  # adjust +5 downwards
+        return surf.blit(frame, (x, draw_y))
+
+# ----- Particles -----
+_puff_atlases = {}
+
+
+def puff_atlas(color=PUFF_COLOR):
+    # atlas[radius][alpha // PUFF_ALPHA_STEP] -> pre-rendered circle sprite
+    atlas = _puff_atlases.get(color)
+    if atlas is None:
+        atlas = []
+        for r in range(PUFF_MAX_RADIUS + 1):
+            sprites = []
+            for level in range(256 // PUFF_ALPHA_STEP):
+                alpha = min(255, level * PUFF_ALPHA_STEP + PUFF_ALPHA_STEP // 2)
+                s = pygame.Surface((max(1, r*2), max(1, r*2)), pygame.SRCALPHA)
+                pygame.draw.circle(s, (color[0], color[1], color[2], alpha), (r, r), r)
+                sprites.append(s)
+            atlas.append(sprites)
+        _puff_atlases[color] = atlas
+    return atlas
+
+
+class ParticleSystem:
+    # Fixed-capacity pool of puffs stored as parallel arrays and updated in bulk
+    def __init__(self, capacity=PARTICLE_CAPACITY, color=PUFF_COLOR, seed=None):
+        self.capacity = capacity
+        self.x = np.zeros(capacity, np.float32)
+        self.y = np.zeros(capacity, np.float32)
+        self.vx = np.zeros(capacity, np.float32)
+        self.vy = np.zeros(capacity, np.float32)
+        self.radius = np.zeros(capacity, np.float32)
+        self.alpha = np.zeros(capacity, np.float32)
+        self.alive = np.zeros(capacity, bool)
+        # Atlas lookups, refreshed by update() so draw() only has to index
+        self.sprite_r = np.zeros(capacity, np.intp)
+        self.sprite_a = np.zeros(capacity, np.intp)
+        self.draw_x = np.zeros(capacity, np.intp)
+        self.draw_y = np.zeros(capacity, np.intp)
+        self._step = np.zeros(capacity, np.float32)  # scratch for update()
+        self.rng = np.random.default_rng(seed)
+        self.atlas = puff_atlas(color)
+
+    def emit(self, x, y, count, spread=8):
+        slots = np.flatnonzero(~self.alive)[:count]
+        n = len(slots)
+        if n == 0:
+            return
+        self.x[slots] = x + self.rng.integers(-spread, spread + 1, n)
+        self.y[slots] = y
+        self.vx[slots] = self.rng.uniform(-0.6, 0.6, n)
+        self.vy[slots] = self.rng.uniform(-1.2, -0.6, n)
+        self.radius[slots] = 6
+        self.alpha[slots] = 220
+        self.alive[slots] = True
+        self._refresh_sprites()
+
+    def update(self, dt):
+        # Velocities and fade rates are per 60 FPS frame
+        frames = dt * FPS
+        np.multiply(self.vx, frames, out=self._step)
+        self.x += self._step
+        np.multiply(self.vy, frames, out=self._step)
+        self.y += self._step
+        self.radius += 0.6 * frames
+        np.minimum(self.radius, PUFF_MAX_RADIUS, out=self.radius)
+        self.alpha -= 6 * frames
+        np.maximum(self.alpha, 0, out=self.alpha)
+        np.greater(self.alpha, 0, out=self.alive)
+        self._refresh_sprites()
+
+    def _refresh_sprites(self):
+        self.sprite_r[:] = self.radius
+        np.floor_divide(self.alpha, PUFF_ALPHA_STEP, out=self.sprite_a, casting="unsafe")
+        np.subtract(self.x, self.sprite_r, out=self.draw_x, casting="unsafe")
+        np.subtract(self.y, self.sprite_r, out=self.draw_y, casting="unsafe")
+
+    def count(self):
+        return int(np.count_nonzero(self.alive))
+
+    def clear(self):
+        self.alive[:] = False
+        self.alpha[:] = 0
+
+    def bounds(self):
+        # Rect covering every live puff, or None
+        live = np.flatnonzero(self.alive)
+        if len(live) == 0:
+            return None
+        x, y = self.draw_x[live], self.draw_y[live]
+        size = 2 * self.sprite_r[live]
+        left, top = int(x.min()), int(y.min())
+        return pygame.Rect(left, top, int((x + size).max()) - left, int((y + size).max()) - top)
 
     def draw(self, surf):
-        if self.alpha <= 0:
+        live = np.flatnonzero(self.alive)
+        if len(live) == 0:
             return
-        s = pygame.Surface((int(self.radius*2), int(self.radius*2)), pygame.SRCALPHA)
-        color = (PUFF_COLOR[0], PUFF_COLOR[1], PUFF_COLOR[2], max(0,int(self.alpha)))
-        pygame.draw.circle(s, color, (int(self.radius), int(self.radius)), int(self.radius))
-        surf.blit(s, (self.x - self.radius, self.y - self.radius))
+        atlas = self.atlas
+        surf.blits(
+            ((atlas[r][a], (x, y)) for r, a, x, y in zip(
+                self.sprite_r[live].tolist(), self.sprite_a[live].tolist(),
+                self.draw_x[live].tolist(), self.draw_y[live].tolist())),
+            doreturn=False,
+        )
+
+# ----- Answer Cubes, Coins, Floating Text -----
+_cube_sprites = {}
+
+
+def cube_sprites(w, h, color=CUBE_COLOR):
+    # frames[0] is the plain cube, frames[i] has the white flash blended in at i / CUBE_FLASH_STEPS
+    key = (w, h, tuple(color))
+    frames = _cube_sprites.get(key)
+    if frames is None:
+        base = pygame.Surface((w, h), pygame.SRCALPHA)
+        pygame.draw.rect(base, color, (0,0,w,h), border_radius=6)
+        frames = [base]
+        for step in range(1, CUBE_FLASH_STEPS + 1):
+            frame = base.copy()
+            overlay = pygame.Surface((w,h), pygame.SRCALPHA)
+            overlay.fill((255,255,255,CUBE_FLASH_ALPHA * step // CUBE_FLASH_STEPS))
+            frame.blit(overlay, (0,0))
+            frames.append(frame)
+        _cube_sprites[key] = frames
+    return frames
+
+
+def flat_cube_sprite(w, h, color=CUBE_COLOR):
+    # The plain cube as an RLE colour-keyed sprite. Its alpha is only ever 0
+    # or 255, so it looks the same and blits several times faster; low quality
+    # levels draw it and skip the flash
+    key = (w, h, tuple(color), "flat")
+    sprite = _cube_sprites.get(key)
+    if sprite is None:
+        base = cube_sprites(w, h, color)[0]
+        sprite = pygame.Surface((w, h))
+        if pygame.display.get_surface() is not None:
+            sprite = sprite.convert()
+        sprite.fill(CUBE_COLORKEY)
+        sprite.blit(base, (0, 0))
+        sprite.set_colorkey(CUBE_COLORKEY, pygame.RLEACCEL)
+        _cube_sprites[key] = sprite
+    return sprite
 
 
 class AnswerCube:
@@ -256,28 +906,34 @@ class AnswerCube:
         self.float_amp = float_amp
         self.float_speed = float_speed
         self.phase = phase
-        self.flash_alpha = 0
+        self.flash_alpha = 0.0
+        self.sprites = cube_sprites(self.w, self.h)
+        self.label = None
+        self.label_font = None
+        self.label_rect = None
 
-    def update(self, t):
-        offset = math.sin(t * self.float_speed + self.phase) * self.float_amp
-        self.rect.y = self.base_y + int(offset) - self.h
+    def update(self, dt):
+        # Bobbing is done for all cubes at once by Bobbing
         if self.flash_alpha > 0:
-            self.flash_alpha = max(0, self.flash_alpha - 12)
+            self.flash_alpha = max(0.0, self.flash_alpha - CUBE_FLASH_DECAY * dt)
 
     def flash(self):
-        self.flash_alpha = 200
+        self.flash_alpha = CUBE_FLASH_ALPHA
 
-    def draw(self, surf, font):
-        cube_surf = pygame.Surface((self.w, self.h), pygame.SRCALPHA)
-        pygame.draw.rect(cube_surf, CUBE_COLOR, (0,0,self.w,self.h), border_radius=6)
-        if self.flash_alpha > 0:
-            overlay = pygame.Surface((self.w,self.h), pygame.SRCALPHA)
-            overlay.fill((255,255,255,int(self.flash_alpha)))
-            cube_surf.blit(overlay, (0,0))
-        surf.blit(cube_surf, (self.rect.x, self.rect.y))
-        txt = font.render(str(self.value), True, TEXT_COLOR)
-        txt_rect = txt.get_rect(center=(self.rect.centerx, self.rect.top - 20))
-        surf.blit(txt, txt_rect)
+    def draw(self, surf, font, rounded=True):
+        if rounded:
+            # Round up so a fading flash never snaps to the plain sprite early
+            step = math.ceil(self.flash_alpha * CUBE_FLASH_STEPS / CUBE_FLASH_ALPHA)
+            surf.blit(self.sprites[step], self.rect)
+        else:
+            surf.blit(flat_cube_sprite(self.w, self.h), self.rect)
+        if self.label_font is not font:
+            self.label = TEXT_CACHE.render(font, str(self.value))
+            self.label_font = font
+            self.label_rect = self.label.get_rect()
+        self.label_rect.center = (self.rect.centerx, self.rect.top - 20)
+        surf.blit(self.label, self.label_rect)
+        return self.rect.union(self.label_rect)
 
 
 class Coin:
@@ -291,12 +947,64 @@ class Coin:
         self.float_speed = float_speed
         self.phase = phase
 
-    def update(self, t):
-        offset = math.sin(t * self.float_speed + self.phase) * self.float_amp
-        self.rect.y = self.base_y + int(offset) - self.h
-
     def draw(self, surf):
-        pygame.draw.ellipse(surf, COIN_COLOR, self.rect)
+        return pygame.draw.ellipse(surf, COIN_COLOR, self.rect)
+
+
+class Bobbing:
+    # Floating motion for a group of cubes or coins: one batched sin per frame
+    # instead of a math.sin per entity. rect.y = base_y + int(sin(t*speed + phase)*amp) - h
+    def __init__(self, entities):
+        self.entities = list(entities)
+        self.batched = len(self.entities) >= BOBBING_BATCH_MIN
+        if not self.batched:
+            # entity -> (top, amp, speed, phase) for the live ones; no arrays to set up
+            self.small = {e: (e.base_y - e.h, e.float_amp, e.float_speed, e.phase)
+                          for e in self.entities}
+            return
+        self.index = {e: i for i, e in enumerate(self.entities)}
+        self.top = np.array([e.base_y - e.h for e in self.entities], np.float64)
+        self.amp = np.array([e.float_amp for e in self.entities], np.float64)
+        self.speed = np.array([e.float_speed for e in self.entities], np.float64)
+        self.phase = np.array([e.phase for e in self.entities], np.float64)
+        self.active = np.ones(len(self.entities), bool)
+        self.offset = np.empty(len(self.entities), np.float64)
+        self.y = np.array([e.rect.y for e in self.entities], np.int64)
+        self.new_y = np.empty_like(self.y)
+
+    def remove(self, entity):
+        if self.batched:
+            self.active[self.index[entity]] = False
+        else:
+            del self.small[entity]
+
+    def update(self, t):
+        # Returns the entities whose rect actually moved
+        if not self.batched:
+            moved_entities = []
+            for e, (top, amp, speed, phase) in self.small.items():
+                y = int(top + math.trunc(math.sin(speed * t + phase) * amp))
+                if y != e.rect.y:
+                    e.rect.y = y
+                    moved_entities.append(e)
+            return moved_entities
+        offset = self.offset
+        np.multiply(self.speed, t, out=offset)
+        offset += self.phase
+        np.sin(offset, out=offset)
+        offset *= self.amp
+        np.trunc(offset, out=offset)
+        offset += self.top
+        np.copyto(self.new_y, offset, casting="unsafe")
+        moved = np.flatnonzero((self.new_y != self.y) & self.active)
+        self.y, self.new_y = self.new_y, self.y
+        entities = self.entities
+        moved_entities = []
+        for i, y in zip(moved.tolist(), self.y[moved].tolist()):
+            e = entities[i]
+            e.rect.y = y
+            moved_entities.append(e)
+        return moved_entities
 
 
 class FloatingText:
@@ -313,18 +1021,104 @@ class FloatingText:
         self.y -= 30 * dt
         return self.age < self.lifetime
 
-    def draw(self, surf, font):
-        alpha = int(255 * max(0, (1 - self.age/self.lifetime)))
-        txt_surf = font.render(self.text, True, self.color)
-        txt_surf.set_alpha(alpha)
-        surf.blit(txt_surf, (self.x, self.y))
+    def draw(self, surf, font, fade=True):
+        alpha = 255
+        if fade:
+            alpha = int(255 * max(0, (1 - self.age/self.lifetime)))
+            # Rounded up, so a new popup starts fully opaque and needs no alpha copy
+            alpha = min(255, -(-alpha // FLOAT_TEXT_ALPHA_STEP) * FLOAT_TEXT_ALPHA_STEP)
+        txt_surf = TEXT_CACHE.render(font, self.text, self.color, alpha)
+        return surf.blit(txt_surf, (self.x, self.y))
+
+# ----- Text Cache -----
+class TextCache:
+    def __init__(self, max_size=TEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color=TEXT_COLOR, alpha=255):
+        key = (font, text, tuple(color), alpha)
+        txt_surf = self.surfaces.get(key)
+        if txt_surf is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return txt_surf
+
+        self.misses += 1
+        txt_surf = font.render(text, True, color)
+        if alpha < 255:
+            txt_surf = txt_surf.convert_alpha()
+            txt_surf.set_alpha(alpha)
+        self.surfaces[key] = txt_surf
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return txt_surf
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        self.surfaces.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+TEXT_CACHE = TextCache()
+
+
+class HudField:
+    # A piece of HUD text that is only re-rendered when its value changes
+    def __init__(self, font, x, y, fmt=str, center=False, color=TEXT_COLOR):
+        self.font = font
+        self.pos = (x, y)
+        self.fmt = fmt
+        self.center = center
+        self.color = color
+        self.value = None
+        self.surf = None
+        self.rect = None
+
+    def set(self, value):
+        if self.surf is not None and value == self.value:
+            return
+        self.value = value
+        self.surf = TEXT_CACHE.render(self.font, self.fmt(value), self.color)
+        self.rect = self.surf.get_rect()
+        if self.center:
+            self.rect.center = self.pos
+        else:
+            self.rect.topleft = self.pos
+
+    def draw(self, surf):
+        return surf.blit(self.surf, self.rect)
+
+
+class Hud:
+    def __init__(self):
+        self.score = HudField(FONT_MED, 12, 8, fmt="Score: {}".format)
+        self.lives = HudField(FONT_MED, WIDTH - 120, 8, fmt="Lives: {}".format)
+        self.timer = HudField(FONT_MED, WIDTH // 2 - 40, 8, fmt="Time: {}s".format)
+        self.combo = HudField(FONT_MED, WIDTH//2 + 60, 40, color=HIGHLIGHT_COLOR,
+                              fmt=lambda combo: f"Combo x{combo}" if combo > 0 else "")
+        self.equation = HudField(FONT_BIG, WIDTH // 2, 60, center=True, color=HIGHLIGHT_COLOR)
+        self.fields = [self.score, self.lives, self.timer, self.combo, self.equation]
+
+    def update(self, score, lives, timer, combo, equation_text):
+        self.score.set(score)
+        self.lives.set(lives)
+        self.timer.set(int(timer))
+        self.combo.set(combo)
+        self.equation.set(equation_text)
+
+    def draw(self, surf):
+        return [field.draw(surf) for field in self.fields]
 
 # ----- Helpers -----
 def draw_text(surf, text, font, x, y, center=False, color=TEXT_COLOR, alpha=255):
-    txt_surf = font.render(text, True, color)
-    if alpha < 255:
-        txt_surf = txt_surf.convert_alpha()
-        txt_surf.set_alpha(alpha)
+    txt_surf = TEXT_CACHE.render(font, text, color, alpha)
     r = txt_surf.get_rect()
     if center:
         r.center = (x, y)
@@ -341,286 +1135,1171 @@ def generate_levels():
         ("10 - 4 = ?", 6, [5, 7, 8]),
     ]
 
+def make_equation(rng, operators="+-*", difficulty=1, wrong_count=WRONG_ANSWERS):
+    # One (text, correct, wrongs) level; operands grow with difficulty
+    op = rng.choice(operators)
+    add_max = 5 + difficulty * 4
+    mul_max = 3 + difficulty
+    if op == "+":
+        a, b = rng.randint(1, add_max), rng.randint(1, add_max)
+        correct = a + b
+    elif op == "-":
+        b, correct = rng.randint(1, add_max), rng.randint(0, add_max)
+        a = b + correct
+    elif op == "*":
+        a, b = rng.randint(2, mul_max), rng.randint(2, mul_max)
+        correct = a * b
+    elif op == "/":
+        b, correct = rng.randint(2, mul_max), rng.randint(1, mul_max)
+        a = b * correct
+    else:
+        raise ValueError(f"unknown operator {op!r}")
+
+    # Plausible mistakes: off by one or two, off by ten, or the typical slip for the operator
+    candidates = {correct + d for d in (-2, -1, 1, 2, -10, 10)}
+    if op == "+":
+        candidates.add(abs(a - b))
+    elif op == "-":
+        candidates.add(a + b)
+    elif op == "*":
+        candidates.update((a + b, correct - a, correct + b))  # off by a row of the table
+    else:
+        candidates.update((a - b, correct * 2))
+    candidates = sorted(c for c in candidates if c >= 0 and c != correct)
+    while len(candidates) < wrong_count:
+        candidates.append(correct + len(candidates) + 3)
+    wrongs = rng.sample(candidates, wrong_count)
+    return f"{a} {op} {b} = ?", correct, wrongs
+
+
+def endless_levels(rng, operators=ENDLESS_OPERATORS, start_difficulty=1,
+                   wrong_count=WRONG_ANSWERS):
+    # Infinite level stream; operators unlock one at a time as difficulty rises
+    level = 0
+    while True:
+        difficulty = min(MAX_DIFFICULTY, start_difficulty + level // LEVELS_PER_DIFFICULTY)
+        unlocked = operators[:max(1, min(len(operators), difficulty))]
+        yield make_equation(rng, unlocked, difficulty, wrong_count)
+        level += 1
+
+
+class LevelQueue:
+    # Small ring buffer in front of any level iterable (a list or an endless
+    # generator), kept full so the next level is always ready
+    def __init__(self, levels, prefetch=LEVEL_PREFETCH):
+        self.source = iter(levels)
+        self.buffer = deque(maxlen=prefetch)
+        self.taken = 0  # levels handed out by next()
+        self.fill()
+
+    def fill(self):
+        while len(self.buffer) < self.buffer.maxlen:
+            try:
+                self.buffer.append(next(self.source))
+            except StopIteration:
+                break
+
+    def has_next(self):
+        return bool(self.buffer)
+
+    def next(self):
+        level = self.buffer.popleft()
+        self.taken += 1
+        self.fill()
+        return level
+
 # ----- Level Setup -----
-def setup_level(levels, idx):
-    eq_text, correct, wrongs = levels[idx]
+def setup_level(level, rng=random):
+    eq_text, correct, wrongs = level
+    if len(wrongs) >= MAX_ANSWER_CUBES:
+        # More answers than fit across the screen: keep a random subset of the wrong ones
+        wrongs = rng.sample(wrongs, MAX_ANSWER_CUBES - 1)
     answers = [correct] + wrongs[:]
-    random.shuffle(answers)
+    rng.shuffle(answers)
 
     # Lower cubes near the ground
-    cube_y = HEIGHT - GROUND_HEIGHT - CUBE_H - 50
+    cube_y = HEIGHT - GROUND_HEIGHT - CUBE_H - CUBE_GAP
     spacing = WIDTH // (len(answers) + 1)
     cubes = []
     for i, a in enumerate(answers):
         x = spacing * (i + 1) - CUBE_W // 2
-        phase = random.uniform(0, math.pi*2)
+        phase = rng.uniform(0, math.pi*2)
         cubes.append(AnswerCube(x, cube_y, a, correct=(a==correct),
-                                float_amp=18, float_speed=1.6, phase=phase))
+                                float_amp=CUBE_FLOAT_AMP, float_speed=CUBE_FLOAT_SPEED, phase=phase))
 
     # Coins floating just above the ground
     coins = []
     coin_base_y = HEIGHT - GROUND_HEIGHT - 20
     for i in range(3):
-        cx = random.randint(50, WIDTH-50)
-        phase = random.uniform(0, math.pi*2)
+        cx = rng.randint(50, WIDTH-50)
+        phase = rng.uniform(0, math.pi*2)
         coins.append(Coin(cx, coin_base_y, float_amp=15, float_speed=2.0, phase=phase))
 
     return eq_text, cubes, correct, coins
 
-# ----- Game Loop -----
-def game_loop(screen, clock):
-    ground_y = HEIGHT - GROUND_HEIGHT
-    levels = generate_levels()
-    current_level = 0
-    score = 0
-    lives = MAX_LIVES
-    timer = LEVEL_TIME
-    combo = 0
-    combo_timer = 0.0
-
-    player = Player(120, ground_y)
-    puffs = []
-    floating_texts = []
-
-    equation_text, cubes, correct_answer, coins = setup_level(levels, current_level)
+# ----- Debug Overlay -----
+DEBUG_REFRESH_MS = 250  # how often the overlay's text is re-rendered
+FRAME_BUDGET_MS = 1000 / FPS
+DEBUG_PHASES = ("events", "player", "world", "collision", "effects",
+                "background", "entities", "hud", "overlays", "flip")
+# Every phase game_loop marks, in order; frames with no SIM_DT step report 0 for the sim phases
+PROFILE_PHASES = DEBUG_PHASES[:-1] + ("debug", "flip")
+
+
+class DebugOverlay:
+    # F3 panel: rolling frame-time graph, FPS, per-phase times, entity counts, cache hit rate
+    def __init__(self, profiler, clock, x=8, y=HEIGHT - 222, w=330, h=214):
+        self.profiler = profiler
+        self.clock = clock
+        self.visible = False
+        self.rect = pygame.Rect(x, y, w, h)
+        self.graph_h = 60
+        self.panel = None
+        self.next_refresh = 0
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.next_refresh = 0
+
+    def render_panel(self):
+        # Straight font.render, so the overlay's ever-changing numbers stay out of TEXT_CACHE
+        sample = self.profiler.last_sample or {}
+        lines = [
+            f"FPS {self.clock.get_fps():5.1f}   frame {self.profiler.average():5.2f} ms",
+        ]
+        for left, right in zip(DEBUG_PHASES[0::2], DEBUG_PHASES[1::2]):
+            lines.append(f"{left} {self.profiler.average(left):.2f}   "
+                         f"{right} {self.profiler.average(right):.2f} ms")
+        lines.append(f"puffs {sample.get('puffs', 0)}  coins {sample.get('coins', 0)}  "
+                     f"texts {sample.get('floating_texts', 0)}  "
+                     f"voices {sample.get('audio_voices', 0)}")
+        lines.append(f"text cache {TEXT_CACHE.hit_rate() * 100:5.1f}% hit   "
+                     f"quality {QUALITY_LEVELS[sample.get('quality', 0)].name}")
+
+        panel = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 170))
+        y = self.graph_h + 6
+        for line in lines:
+            panel.blit(FONT_SMALL.render(line, True, TEXT_COLOR), (6, y))
+            y += FONT_SMALL.get_linesize()
+        self.panel = panel
 
-    show_level_intro = True
-    level_intro_timer = 0.0
-
-    t0 = pygame.time.get_ticks() / 1000.0
-    game_over = False
-    win = False
-
-    cloud_offset = 0
-    far_ground_offset = 0
-
-    sky_scroll = 0
-    cloud_scroll = 0
-    far_ground_scroll = 0
-
-    sky_speed = 0.2
-    cloud_speed = 0.4
-    far_ground_speed = 0.8
-
-    while True:
-        dt_ms = clock.tick(FPS)
-        dt = dt_ms / 1000.0
-        t = pygame.time.get_ticks() / 1000.0
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    return "exit"
-                if event.key in (pygame.K_SPACE, pygame.K_UP):
-                    if player.jump():
-                        jump_sfx.play()
-                        for _ in range(3):
-                            puffs.append(Puff(player.rect.centerx + random.randint(-8,8),
-                                              player.rect.bottom - 6))
-                if event.key == pygame.K_r and (game_over or win):
-                    return "restart"
-            elif event.type == pygame.KEYUP:
-                if event.key in (pygame.K_SPACE, pygame.K_UP):
-                    player.release_jump()
-
-        keys = pygame.key.get_pressed()
-        if not game_over and not win:
-            player.update(keys, dt)
+    def draw(self, surf):
+        if not self.visible:
+            return
+        now = pygame.time.get_ticks()
+        if self.panel is None or now >= self.next_refresh:
+            self.render_panel()
+            self.next_refresh = now + DEBUG_REFRESH_MS
+        surf.blit(self.panel, self.rect)
+
+        # Frame-time graph, one column per frame, with the 60 FPS budget as a line
+        scale = self.graph_h / (FRAME_BUDGET_MS * 2)
+        bottom = self.rect.top + self.graph_h
+        history = self.profiler.history
+        x = self.rect.right - len(history)
+        for ms in history:
+            color = CORRECT_COLOR if ms <= FRAME_BUDGET_MS else WRONG_COLOR
+            pygame.draw.line(surf, color, (x, bottom), (x, bottom - min(self.graph_h, ms * scale)))
+            x += 1
+        budget_y = bottom - FRAME_BUDGET_MS * scale
+        pygame.draw.line(surf, HIGHLIGHT_COLOR, (self.rect.left, budget_y), (self.rect.right, budget_y))
+
+# ----- Quality -----
+# What each level keeps: share of puffs emitted, FloatingText fading,
+# rounded (alpha-blended) cubes, the cloud layer, parallax scrolling
+Quality = namedtuple("Quality", "name puffs fade rounded_cubes clouds scrolling")
+QUALITY_LEVELS = (
+    Quality("full", 1.0, True, True, True, True),
+    Quality("fewer puffs", 0.5, True, True, True, True),
+    Quality("flat effects", 0.25, False, False, True, True),
+    Quality("no clouds", 0.25, False, False, False, True),
+    Quality("still background", 0.25, False, False, False, False),
+)
+
+
+class QualityGovernor:
+    # Fed the busy time of each frame (the frame minus what clock.tick slept).
+    # Every QUALITY_WINDOW frames it looks at the 90th percentile: over budget
+    # steps quality down at once, well under budget for QUALITY_UP_WINDOWS
+    # windows in a row steps it back up. A step up that is undone straight
+    # away doubles that wait, so a level that doesn't fit isn't retried every
+    # few seconds.
+    def __init__(self, budget_ms=FRAME_BUDGET_MS, window=QUALITY_WINDOW, enabled=ADAPTIVE_QUALITY):
+        self.budget_ms = budget_ms
+        self.window = window
+        self.enabled = enabled
+        self.level = 0
+        self.samples = []
+        self.p90 = 0.0  # of the last full window
+        self.calm = 0  # windows of headroom in a row
+        self.up_after = QUALITY_UP_WINDOWS
+        self.since_up = None  # windows since the last step up
+
+    @property
+    def quality(self):
+        return QUALITY_LEVELS[self.level]
+
+    def add(self, busy_ms):
+        # Returns True when the level changed
+        if not self.enabled:
+            return False
+        self.samples.append(busy_ms)
+        if len(self.samples) < self.window:
+            return False
+        self.samples.sort()
+        self.p90 = self.samples[len(self.samples) * 9 // 10]
+        self.samples.clear()
+        if self.since_up is not None:
+            self.since_up += 1
+
+        if self.p90 > self.budget_ms:
+            self.calm = 0
+            if self.since_up is not None and self.since_up <= QUALITY_UP_WINDOWS:
+                self.up_after = min(self.up_after * 2, QUALITY_MAX_UP_WINDOWS)
+            if self.level < len(QUALITY_LEVELS) - 1:
+                self.level += 1
+                return True
+        elif self.p90 < self.budget_ms * QUALITY_UP_RATIO and self.level > 0:
+            self.calm += 1
+            if self.calm >= self.up_after:
+                self.calm = 0
+                self.since_up = 0
+                self.level -= 1
+                return True
+        else:
+            self.calm = 0
+        return False
 
-        # Update puffs
-        puffs = [p for p in puffs if p.update()]
-        # Update cubes
-        for c in cubes:
-            c.update(t)
-        # Update coins
-        for c in coins:
-            c.update(t)
-        # Update floating texts
-        floating_texts = [f for f in floating_texts if f.update(dt)]
+# ----- Collision -----
+class SpatialGrid:
+    # Uniform-grid broad phase. Entities are re-bucketed only when they move into
+    # different cells, removal only touches the cells they cover, and queries
+    # return hits in insertion order so results are deterministic
+    def __init__(self, cell=GRID_CELL):
+        self.cell = cell
+        self.cells = {}  # (cx, cy) -> {item: None}, used as an ordered set
+        self.spans = {}  # item -> (x0, y0, x1, y1) cell span it is bucketed under
+        self.order = {}  # item -> insertion number
+        self.inserted = 0
+
+    def __len__(self):
+        return len(self.spans)
+
+    def span(self, rect):
+        c = self.cell
+        return (rect.left // c, rect.top // c, (rect.right - 1) // c, (rect.bottom - 1) // c)
+
+    def _bucket(self, item, span):
+        x0, y0, x1, y1 = span
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket is None:
+                    bucket = self.cells[(cx, cy)] = {}
+                bucket[item] = None
+
+    def _unbucket(self, item, span):
+        x0, y0, x1, y1 = span
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = self.cells[(cx, cy)]
+                del bucket[item]
+                if not bucket:
+                    del self.cells[(cx, cy)]
+
+    def insert(self, item):
+        span = self.span(item.rect)
+        self.spans[item] = span
+        self.order[item] = self.inserted
+        self.inserted += 1
+        self._bucket(item, span)
+
+    def move(self, item):
+        # Call after item.rect changed
+        span = self.span(item.rect)
+        old = self.spans[item]
+        if span != old:
+            self._unbucket(item, old)
+            self._bucket(item, span)
+            self.spans[item] = span
+
+    def remove(self, item):
+        self._unbucket(item, self.spans.pop(item))
+        del self.order[item]
+
+    def query(self, rect):
+        # Like rect.collidelistall, but returns the colliding items themselves
+        x0, y0, x1, y1 = self.span(rect)
+        hits = []
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket:
+                    for item in bucket:
+                        if item not in hits and rect.colliderect(item.rect):
+                            hits.append(item)
+        if len(hits) > 1:
+            hits.sort(key=self.order.__getitem__)
+        return hits
+
+    def query_many(self, rects):
+        return [self.query(rect) for rect in rects]
+
+# ----- Game State -----
+# One simulation step's worth of player input
+Inputs = namedtuple("Inputs", "left right jump release_jump", defaults=(False, False, False, False))
+NO_INPUT = Inputs()
+
+# Something the renderer / audio should react to, emitted by GameState.step
+# value is the answer on the cube that was hit, for correct / wrong
+GameEvent = namedtuple("GameEvent", "kind x y points combo value", defaults=(0, 0, None))
+
+# What the renderer needs from a GameState, as plain values (see GameState.frame).
+# player: (prev_x, prev_y, x, y, on_ground, facing_right); cubes: (x, y, value, flash_alpha)
+# per cube; coins: (x, y) per coin; at: perf_counter() time of the last step
+FrameSnapshot = namedtuple("FrameSnapshot", "player cubes coins score lives timer combo "
+                           "equation_text current_level show_level_intro game_over win at")
+
+
+class GameState:
+    # The game rules without any drawing, sound or real time, so it can run headless
+    def __init__(self, levels=None, seed=None, endless=False, bank=None, topic=None):
+        self.rng = random.Random(seed)
+        self.endless = endless
+        self.bank = bank
+        self.topic = topic
+        self.level_seed = None
+        if levels is None:
+            if endless or bank is not None:
+                # Kept so restore() can rebuild the level stream
+                self.level_seed = self.rng.getrandbits(64)
+                levels = self.seeded_levels()
+            else:
+                levels = generate_levels()
+        self.level_source = levels
+        self.levels = LevelQueue(levels)
+        self.level = self.levels.next()
+        self.ground_y = HEIGHT - GROUND_HEIGHT
+        self.current_level = 0
+        self.score = 0
+        self.lives = MAX_LIVES
+        self.timer = LEVEL_TIME
+        self.combo = 0
+        self.best_combo = 0
+        self.combo_timer = 0.0
+        self.time = 0.0
+        self.game_over = False
+        self.win = False
+        self.show_level_intro = True
+        self.level_intro_timer = 0.0
+        self.events = []
+
+        self.player = None
+        self.restart_level()
+
+    @property
+    def finished(self):
+        return self.game_over or self.win
+
+    def emit(self, kind, x, y, points=0, combo=0, value=None):
+        self.events.append(GameEvent(kind, x, y, points, combo, value))
+
+    def restart_level(self):
+        if self.player is None:
+            self.player = Player(PLAYER_START_X, self.ground_y)
+        else:
+            self.player.reset(PLAYER_START_X)
+        self.equation_text, cubes, self.correct_answer, coins = \
+            setup_level(self.level, self.rng)
+        self.place_entities(cubes, coins)
+        self.timer = LEVEL_TIME
+
+    def place_entities(self, cubes, coins):
+        self.cubes = cubes
+        # dict as an ordered set, so a collected coin is removed in O(1)
+        self.coins = dict.fromkeys(coins)
+        self.cube_grid = SpatialGrid()
+        for c in self.cubes:
+            self.cube_grid.insert(c)
+        self.coin_grid = SpatialGrid()
+        for coin in self.coins:
+            self.coin_grid.insert(coin)
+        self.cube_bobbing = Bobbing(self.cubes)
+        self.coin_bobbing = Bobbing(self.coins)
+
+    # Plain attributes a snapshot copies as they are
+    SNAPSHOT_FIELDS = ("level", "current_level", "score", "lives", "timer", "combo",
+                       "best_combo", "combo_timer", "time", "game_over", "win", "show_level_intro",
+                       "level_intro_timer", "equation_text", "correct_answer")
+
+    def snapshot(self):
+        # Everything step() depends on, as immutable values; restore() puts it back
+        p = self.player
+        snap = {name: getattr(self, name) for name in self.SNAPSHOT_FIELDS}
+        snap["rng"] = self.rng.getstate()
+        snap["levels_taken"] = self.levels.taken
+        snap["level_seed"] = self.level_seed
+        snap["player"] = (p.x, p.y, p.prev_x, p.prev_y, p.vel_y, p.on_ground,
+                          p.holding_jump, p.jump_time, p.facing_right)
+        snap["cubes"] = tuple((c.base_x, c.base_y, c.value, c.correct, c.float_amp,
+                               c.float_speed, c.phase, c.flash_alpha) for c in self.cubes)
+        snap["coins"] = tuple((c.base_x, c.base_y, c.float_amp, c.float_speed, c.phase)
+                              for c in self.coins)
+        return snap
+
+    def seeded_levels(self):
+        # The level stream for self.level_seed: random questions from the bank
+        # (BANK_LEVELS of them outside endless mode) or generated equations
+        rng = random.Random(self.level_seed)
+        if self.bank is None:
+            return endless_levels(rng)
+        levels = self.bank.levels(rng, self.topic, levels_per_difficulty=LEVELS_PER_DIFFICULTY,
+                                  wrong_count=WRONG_ANSWERS)
+        return levels if self.endless else islice(levels, BANK_LEVELS)
+
+    def restore(self, snap):
+        self.level_seed = snap["level_seed"]
+        if self.level_seed is not None:
+            levels = LevelQueue(self.seeded_levels())
+        elif isinstance(self.level_source, (list, tuple)):
+            levels = LevelQueue(self.level_source)
+        else:
+            raise ValueError("levels from a one-shot iterator can't be restored")
+        while levels.taken < snap["levels_taken"]:
+            levels.next()
+        self.levels = levels
+        for name in self.SNAPSHOT_FIELDS:
+            setattr(self, name, snap[name])
+        self.rng.setstate(snap["rng"])
+
+        player = self.player
+        player.reset(PLAYER_START_X)
+        (player.x, player.y, player.prev_x, player.prev_y, player.vel_y, player.on_ground,
+         player.holding_jump, player.jump_time, player.facing_right) = snap["player"]
+        player.rect.x = int(player.x)
+        player.rect.y = int(player.y)
+
+        cubes = []
+        for base_x, base_y, value, correct, amp, speed, phase, flash_alpha in snap["cubes"]:
+            c = AnswerCube(base_x, base_y, value, correct, amp, speed, phase)
+            c.flash_alpha = flash_alpha
+            cubes.append(c)
+        coins = [Coin(*args) for args in snap["coins"]]
+        self.place_entities(cubes, coins)
+        # Bring the floating entities to where they were at this time
+        for c in self.cube_bobbing.update(self.time):
+            self.cube_grid.move(c)
+        for c in self.coin_bobbing.update(self.time):
+            self.coin_grid.move(c)
+        self.events = []
+
+    def lose_life(self):
+        self.lives -= 1
+        if self.lives <= 0:
+            self.game_over = True
+            self.emit("game_over", self.player.rect.centerx, self.player.rect.top)
+        else:
+            self.restart_level()
+
+    def step(self, inputs, dt):
+        # Advance the game by dt seconds; returns the events that happened
+        self.begin_step(dt)
+        self.update_player(inputs, dt)
+        self.update_world(dt)
+        self.check_collisions()
+        self.update_intro(dt)
+        return self.events
+
+    def frame(self, at):
+        # Immutable copy of what is drawn, for the pipelined game loop
+        p = self.player
+        return FrameSnapshot(
+            (p.prev_x, p.prev_y, p.x, p.y, p.on_ground, p.facing_right),
+            tuple((c.rect.x, c.rect.y, c.value, c.flash_alpha) for c in self.cubes),
+            tuple((c.rect.x, c.rect.y) for c in self.coins),
+            self.score, self.lives, self.timer, self.combo, self.equation_text,
+            self.current_level, self.show_level_intro, self.game_over, self.win, at)
+
+    def begin_step(self, dt):
+        self.events.clear()
+        self.time += dt
+
+    def update_player(self, inputs, dt):
+        player = self.player
+        if inputs.jump and player.jump():
+            self.emit("jump", player.rect.centerx, player.rect.bottom - 6)
+        if inputs.release_jump:
+            player.release_jump()
+
+        if not self.finished:
+            player.update(inputs, dt)
+            if player.walking:
+                self.emit("walk", player.rect.centerx, player.rect.bottom)
+            if player.landing_speed >= LANDING_MIN_SPEED:
+                self.emit("land", player.rect.centerx, player.rect.bottom - 6)
+
+    def update_world(self, dt):
+        for c in self.cube_bobbing.update(self.time):
+            self.cube_grid.move(c)
+        for c in self.coin_bobbing.update(self.time):
+            self.coin_grid.move(c)
+        for c in self.cubes:
+            c.update(dt)
 
         # Countdown timer
-        if not show_level_intro and not game_over and not win:
-            timer -= dt
-            if timer <= 0:
-                lives -= 1
-                if lives <= 0:
-                    game_over = True
-                else:
-                    player = Player(120, ground_y)
-                    equation_text, cubes, correct_answer, coins = setup_level(levels, current_level)
-                    timer = LEVEL_TIME
-                    combo = 0
-                    combo_timer = 0.0
+        if not self.show_level_intro and not self.finished:
+            self.timer -= dt
+            if self.timer <= 0:
+                self.emit("timeout", self.player.rect.centerx, self.player.rect.top)
+                self.combo = 0
+                self.combo_timer = 0.0
+                self.lose_life()
 
         # Combo timer decay
-        if combo > 0:
-            combo_timer += dt
-            if combo_timer >= COMBO_RESET_TIME:
-                combo = 0
-                combo_timer = 0.0
-
-        # Collision detection - cubes
-        if not game_over and not win and not show_level_intro:
-            for c in cubes:
-                if player.rect.colliderect(c.rect):
-                    if c.correct:
-                        c.flash()
-                        combo += 1
-                        combo_timer = 0.0
-                        gained = SCORE_CORRECT * combo
-                        score += gained
-                        score_sfx.play()
-                        floating_texts.append(FloatingText(player.rect.centerx,
-                                                           player.rect.top,
-                                                           f"+{gained} x{combo}",
-                                                           CORRECT_COLOR))
-                        current_level += 1
-                        if current_level >= len(levels):
-                            win = True
-                        else:
-                            player = Player(120, ground_y)
-                            equation_text, cubes, correct_answer, coins = setup_level(levels, current_level)
-                            timer = LEVEL_TIME
-                            show_level_intro = True
-                            level_intro_timer = 0.0
+        if self.combo > 0:
+            self.combo_timer += dt
+            if self.combo_timer >= COMBO_RESET_TIME:
+                self.combo = 0
+                self.combo_timer = 0.0
+
+    def check_collisions(self):
+        player = self.player
+        # Cubes
+        if not self.finished and not self.show_level_intro:
+            hits = self.cube_grid.query(player.rect)
+            if hits:
+                # Only the first cube touched counts
+                c = hits[0]
+                self.emit("cube_hit", c.rect.centerx, c.rect.bottom)
+                if c.correct:
+                    c.flash()
+                    self.combo += 1
+                    self.best_combo = max(self.best_combo, self.combo)
+                    self.combo_timer = 0.0
+                    gained = SCORE_CORRECT * self.combo
+                    self.score += gained
+                    self.emit("correct", player.rect.centerx, player.rect.top, gained, self.combo,
+                              c.value)
+                    self.current_level += 1
+                    if not self.levels.has_next():
+                        self.win = True
+                        self.emit("win", player.rect.centerx, player.rect.top)
                     else:
-                        lives -= 1
-                        score += SCORE_WRONG
-                        floating_texts.append(FloatingText(player.rect.centerx,
-                                                           player.rect.top,
-                                                           f"{SCORE_WRONG}",
-                                                           WRONG_COLOR))
-                        combo = 0
-                        combo_timer = 0.0
-                        if lives <= 0:
-                            game_over = True
-                        else:
-                            player = Player(120, ground_y)
-                            equation_text, cubes, correct_answer, coins = setup_level(levels, current_level)
-                            timer = LEVEL_TIME
-                    break
-
-        # Collision detection - coins
-        for coin in coins[:]:
-            if player.rect.colliderect(coin.rect):
-                score_sfx.play()
-                score += SCORE_COIN
-                floating_texts.append(FloatingText(player.rect.centerx,
-                                                   player.rect.top,
-                                                   f"+{SCORE_COIN}",
-                                                   HIGHLIGHT_COLOR))
-                coins.remove(coin)
-
-        # Level intro
-        if show_level_intro:
-            level_intro_timer += dt
-            if level_intro_timer > 1.0:
-                show_level_intro = False
-
-        # --- Draw everything ---
-        # --- Parallax Background ---
-        # Update scrolling offsets
-        sky_scroll = (sky_scroll - sky_speed) % WIDTH
-        cloud_scroll = (cloud_scroll - cloud_speed) % WIDTH
-        far_ground_scroll = (far_ground_scroll - far_ground_speed) % WIDTH
-
-        # --- Scale backgrounds to fit screen width ---
-        sky_height = 750  # pixels tall — try smaller or larger
-        sky_scaled = pygame.transform.scale(SKY_BG, (WIDTH, sky_height))
-        cloud_scaled = pygame.transform.scale(CLOUD, (WIDTH, CLOUD.get_height()))
-        far_ground_scaled = pygame.transform.scale(FAR_GROUND, (WIDTH, FAR_GROUND.get_height()))
-
-        # --- Draw Sky ---
-        screen.blit(sky_scaled, (-sky_scroll, 0))
-        screen.blit(sky_scaled, (WIDTH - sky_scroll, 0))
-
-        # --- Draw Clouds ---
-        cloud_y = 70
-        screen.blit(cloud_scaled, (-cloud_scroll, cloud_y))
-        screen.blit(cloud_scaled, (WIDTH - cloud_scroll, cloud_y))
-
-        # --- Draw Far Ground ---
-        far_ground_y = HEIGHT - GROUND_HEIGHT - far_ground_scaled.get_height()
-        screen.blit(far_ground_scaled, (-far_ground_scroll, far_ground_y))
-        screen.blit(far_ground_scaled, (WIDTH - far_ground_scroll, far_ground_y))
-
-        # --- Draw tiled platform ground ---
-        tile_w, tile_h = GROUND_TILE.get_size()
-        overlap = 1
-        tile_w, tile_h = GROUND_TILE.get_size()
-        overlap = 8  # Try 1 or 2 pixels
-        for x in range(0, WIDTH, tile_w - overlap):
-            screen.blit(GROUND_TILE, (x, HEIGHT - tile_h))
+                        self.level = self.levels.next()
+                        self.restart_level()
+                        self.show_level_intro = True
+                        self.level_intro_timer = 0.0
+                else:
+                    self.score += SCORE_WRONG
+                    self.emit("wrong", player.rect.centerx, player.rect.top, SCORE_WRONG,
+                              value=c.value)
+                    self.combo = 0
+                    self.combo_timer = 0.0
+                    self.lose_life()
 
+        # Coins
+        for coin in self.coin_grid.query(self.player.rect):
+            self.score += SCORE_COIN
+            self.emit("coin", self.player.rect.centerx, self.player.rect.top, SCORE_COIN)
+            self.coin_grid.remove(coin)
+            self.coin_bobbing.remove(coin)
+            del self.coins[coin]
+
+    def update_intro(self, dt):
+        if self.show_level_intro:
+            self.level_intro_timer += dt
+            if self.level_intro_timer > 1.0:
+                self.show_level_intro = False
 
+# ----- Game Loop -----
+def read_inputs(events):
+    keys = pygame.key.get_pressed()
+    jump = release_jump = False
+    for event in events:
+        if event.type == pygame.KEYDOWN and event.key in (pygame.K_SPACE, pygame.K_UP):
+            jump = True
+        elif event.type == pygame.KEYUP and event.key in (pygame.K_SPACE, pygame.K_UP):
+            release_jump = True
+    return Inputs(keys[pygame.K_LEFT] or keys[pygame.K_a],
+                  keys[pygame.K_RIGHT] or keys[pygame.K_d],
+                  jump, release_jump)
+
+
+class DirtyTracker:
+    # Every region drawn in a frame is painted back with background the next
+    # frame, and both are pushed to the window with display.update(rects)
+    def __init__(self):
+        self.drawn = []  # regions drawn this frame
+        self.last = []  # regions drawn last frame
+        self.repaint = True  # next frame must redraw the whole background
+        self.full = True  # this frame is presented with a full flip
+
+    def add(self, rect):
+        if rect is not None:
+            self.drawn.append(rect)
+
+    def invalidate(self):
+        self.full = True
+        self.repaint = True
+
+    def present(self):
+        if self.full:
+            DISPLAY.flip()
+        else:
+            DISPLAY.update(self.last + self.drawn)
+        self.last, self.drawn = self.drawn, self.last
+        self.drawn.clear()
+        self.full = False
+
+
+class GameView:
+    # Everything about a session that is only for show: effects, sounds, HUD, overlays
+    def __init__(self, background=None, seed=None, dirty_rects=DIRTY_RECT_RENDERING):
+        self.background = background if background is not None else Background()
+        self.particles = ParticleSystem(seed=seed)
+        self.floating_texts = []
+        self.hud = Hud()
+        self.dirty = DirtyTracker() if dirty_rects else None
+        self.overlay_key = None  # what self.overlay shows
+        self.overlay = None
+        self.set_quality(QUALITY_LEVELS[0])
+
+    def set_quality(self, quality):
+        self.quality = quality
+        self.background.set_detail(quality.clouds, quality.scrolling)
+        if self.dirty is not None:
+            self.dirty.invalidate()
+
+    def emit_puffs(self, x, y, count, **kwargs):
+        self.particles.emit(x, y, max(1, round(count * self.quality.puffs)), **kwargs)
+
+    def handle_events(self, events):
+        for ev in events:
+            if ev.kind == "jump":
+                AUDIO.play("jump")
+                self.emit_puffs(ev.x, ev.y, JUMP_PUFFS)
+            elif ev.kind == "walk":
+                AUDIO.play("walk")
+            elif ev.kind == "land":
+                self.emit_puffs(ev.x, ev.y, LANDING_PUFFS)
+            elif ev.kind == "cube_hit":
+                self.emit_puffs(ev.x, ev.y, HIT_PUFFS, spread=CUBE_W // 2)
+            elif ev.kind == "correct":
+                AUDIO.play("score")
+                self.floating_texts.append(FloatingText(ev.x, ev.y, f"+{ev.points} x{ev.combo}",
+                                                        CORRECT_COLOR))
+            elif ev.kind == "wrong":
+                self.floating_texts.append(FloatingText(ev.x, ev.y, f"{ev.points}", WRONG_COLOR))
+            elif ev.kind == "coin":
+                AUDIO.play("score")
+                self.floating_texts.append(FloatingText(ev.x, ev.y, f"+{ev.points}",
+                                                        HIGHLIGHT_COLOR))
+            elif ev.kind in ("game_over", "win"):
+                AUDIO.play("game_over")
+
+    def update(self, state, dt):
+        AUDIO.flush()
+        if not state.finished:
+            state.player.animate(dt)
+        # Update puffs
+        self.particles.update(dt)
+        # Update floating texts
+        self.floating_texts = [f for f in self.floating_texts if f.update(dt)]
+        self.background.update(dt)
+
+    def draw(self, surf, state, alpha=1.0):
+        self.draw_background(surf)
+        self.draw_entities(surf, state, alpha)
+        self.draw_hud(surf, state)
+        self.draw_overlays(surf, state)
+
+    def draw_background(self, surf):
+        dirty = self.dirty
+        if dirty is None:
+            self.background.draw(surf)
+        elif dirty.repaint or self.background.scrolling:
+            self.background.draw(surf)
+            dirty.full = True
+            dirty.repaint = False
+        else:
+            for rect in dirty.last:
+                self.background.restore(surf, rect)
 
+    def draw_entities(self, surf, state, alpha=1.0):
+        dirty = self.dirty
         # Puffs
-        for puff in puffs:
-            puff.draw(screen)
+        self.particles.draw(surf)
+        if dirty is not None:
+            dirty.add(self.particles.bounds())
         # Coins
-        for coin in coins:
-            coin.draw(screen)
+        for coin in state.coins:
+            r = coin.draw(surf)
+            if dirty is not None:
+                dirty.add(r)
         # Player
-        player.draw(screen)
+        r = state.player.draw(surf, alpha)
+        if dirty is not None:
+            dirty.add(r)
         # Cubes
-        for c in cubes:
-            c.draw(screen, FONT_SMALL)
+        rounded = self.quality.rounded_cubes
+        for c in state.cubes:
+            r = c.draw(surf, FONT_SMALL, rounded)
+            if dirty is not None:
+                dirty.add(r)
         # Floating texts
-        for ft in floating_texts:
-            ft.draw(screen, FONT_SMALL)
-
-        # HUD
-        draw_text(screen, f"Score: {score}", FONT_MED, 12, 8)
-        draw_text(screen, f"Lives: {lives}", FONT_MED, WIDTH - 120, 8)
-        draw_text(screen, f"Time: {int(timer)}s", FONT_MED, WIDTH // 2 - 40, 8)
-        draw_text(screen, f"Combo x{combo}" if combo>0 else "", FONT_MED, WIDTH//2 + 60, 40, color=HIGHLIGHT_COLOR)
-        draw_text(screen, equation_text, FONT_BIG, WIDTH // 2, 60, center=True, color=HIGHLIGHT_COLOR)
-
-        # Level intro overlay
-        if show_level_intro:
-            overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+        fade = self.quality.fade
+        for ft in self.floating_texts:
+            r = ft.draw(surf, FONT_SMALL, fade)
+            if dirty is not None:
+                dirty.add(r)
+
+    def draw_hud(self, surf, state):
+        self.hud.update(state.score, state.lives, state.timer, state.combo, state.equation_text)
+        rects = self.hud.draw(surf)
+        if self.dirty is not None:
+            self.dirty.drawn.extend(rects)
+
+    def draw_overlays(self, surf, state):
+        if self.dirty is not None and (state.show_level_intro or state.finished):
+            # Translucent full-screen overlays touch every pixel
+            self.dirty.invalidate()
+
+        # Game over / win take precedence over the level intro
+        if state.game_over:
+            key = ("game_over", state.score)
+        elif state.win:
+            key = ("win", state.score)
+        elif state.show_level_intro:
+            key = ("intro", state.current_level)
+        else:
+            return
+        if key != self.overlay_key:
+            # Built once per overlay, not every frame it is shown
+            self.overlay_key, self.overlay = key, self.build_overlay(*key)
+        surf.blit(self.overlay, (0,0))
+
+    @staticmethod
+    def build_overlay(kind, value):
+        overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+        if kind == "intro":
             overlay.fill((0,0,0,140))
-            screen.blit(overlay, (0,0))
-            draw_text(screen, f"Level {current_level+1}", FONT_BIG, WIDTH//2, HEIGHT//2, center=True, color=HIGHLIGHT_COLOR)
-
-        # Game over / win overlays
-        if game_over:
-            overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+            draw_text(overlay, f"Level {value+1}", FONT_BIG, WIDTH//2, HEIGHT//2, center=True, color=HIGHLIGHT_COLOR)
+        elif kind == "game_over":
             overlay.fill((0,0,0,180))
-            screen.blit(overlay, (0,0))
-            game_over_sfx.play()
-            
-            draw_text(screen, "GAME OVER", FONT_BIG, WIDTH//2, HEIGHT//3, center=True, color=WRONG_COLOR)
-            draw_text(screen, f"Final Score: {score}", FONT_MED, WIDTH//2, HEIGHT//2, center=True)
-            draw_text(screen, "Press R to restart or ESC to quit", FONT_SMALL, WIDTH//2, HEIGHT//2 + 50, center=True)
-        elif win:
-            overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+            draw_text(overlay, "GAME OVER", FONT_BIG, WIDTH//2, HEIGHT//3, center=True, color=WRONG_COLOR)
+            draw_text(overlay, f"Final Score: {value}", FONT_MED, WIDTH//2, HEIGHT//2, center=True)
+            draw_text(overlay, "Press R to restart or ESC to quit", FONT_SMALL, WIDTH//2, HEIGHT//2 + 50, center=True)
+        else:
             overlay.fill((0,0,0,140))
-            screen.blit(overlay, (0,0))
-            game_over_sfx.play()
-            draw_text(screen, "YOU WIN!", FONT_BIG, WIDTH//2, HEIGHT//3, center=True, color=CORRECT_COLOR)
-            draw_text(screen, f"Final Score: {score}", FONT_MED, WIDTH//2, HEIGHT//2, center=True)
-            draw_text(screen, "Press R to play again or ESC to quit", FONT_SMALL, WIDTH//2, HEIGHT//2 + 50, center=True)
-
-        pygame.display.flip()
+            draw_text(overlay, "YOU WIN!", FONT_BIG, WIDTH//2, HEIGHT//3, center=True, color=CORRECT_COLOR)
+            draw_text(overlay, f"Final Score: {value}", FONT_MED, WIDTH//2, HEIGHT//2, center=True)
+            draw_text(overlay, "Press R to play again or ESC to quit", FONT_SMALL, WIDTH//2, HEIGHT//2 + 50, center=True)
+        return overlay
+
+    def settled(self):
+        # No effect still moving on screen
+        return not self.floating_texts and self.particles.count() == 0
+
+    def present(self):
+        if self.dirty is None:
+            DISPLAY.flip()
+        else:
+            self.dirty.present()
+
+
+class WindowState:
+    # Focus and visibility, from the window events SDL sends
+    def __init__(self):
+        self.focused = True
+        self.minimised = False
+        self.exposed = False  # contents were lost and need presenting again
+
+    def handle(self, event):
+        if event.type == pygame.WINDOWFOCUSLOST:
+            self.focused = False
+        elif event.type == pygame.WINDOWFOCUSGAINED:
+            self.focused = True
+        elif event.type in (pygame.WINDOWMINIMIZED, pygame.WINDOWHIDDEN):
+            self.minimised = True
+        elif event.type in (pygame.WINDOWRESTORED, pygame.WINDOWSHOWN, pygame.WINDOWMAXIMIZED):
+            self.minimised = False
+            self.exposed = True
+        elif event.type == pygame.WINDOWEXPOSED:
+            self.exposed = True
+
+
+class Session:
+    # One game: the rules plus everything that follows each step (replay,
+    # telemetry, high score). step() is all a simulation thread runs.
+    def __init__(self, state, seed, endless, recorder=None, scores=None, player_name=None,
+                 telemetry=None):
+        self.state = state
+        self.recorder = recorder
+        self.scores = scores
+        self.player_name = player_name
+        self.telemetry = telemetry
+        self.id = f"{int(time.time())}-{seed:08x}"
+        self.mode = "endless" if endless else "levels"
+        self.saved = False
+
+    def step(self, inputs, mark=None):
+        # One SIM_DT step; mark(phase) is the profiler's, when on the thread it times
+        state = self.state
+        if self.recorder is not None:
+            self.recorder.record(inputs)
+        state.begin_step(SIM_DT)
+        state.update_player(inputs, SIM_DT)
+        if mark:
+            mark("player")
+        state.update_world(SIM_DT)
+        if mark:
+            mark("world")
+        # The level being answered, before a correct answer moves on
+        level_no, equation = state.current_level + 1, state.equation_text
+        answer_time = LEVEL_TIME - state.timer
+        state.check_collisions()
+        state.update_intro(SIM_DT)
+        if mark:
+            mark("collision")
+        if self.telemetry is not None and state.events:
+            self.telemetry.game_events(state.events, self.id, self.mode, level_no, equation,
+                                       answer_time, LEVEL_TIME, state.lives, state.score)
+        if state.finished and not self.saved and self.scores is not None:
+            # Only queued here; the store writes it on its own thread
+            self.scores.submit(state.score, state.current_level + (0 if state.win else 1),
+                               state.best_combo, state.time, self.mode, state.win,
+                               self.player_name)
+            self.saved = True
+        return state.events
+
+
+class InputLatch:
+    # Hands inputs from the main thread to the simulation thread: the keys held
+    # as of the latest frame, plus jump presses/releases no step has seen yet
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.held = NO_INPUT
+        self.jump = False
+        self.release_jump = False
+
+    def push(self, inputs):
+        with self.lock:
+            self.held = inputs
+            self.jump = self.jump or inputs.jump
+            self.release_jump = self.release_jump or inputs.release_jump
+
+    def take(self):
+        with self.lock:
+            inputs = self.held._replace(jump=self.jump, release_jump=self.release_jump)
+            self.jump = self.release_jump = False
+        return inputs
+
+
+class FrameBuffer:
+    # Double buffer of FrameSnapshots: the simulation fills the back slot and
+    # swaps, the renderer reads the front one. Snapshots are immutable, so a
+    # frame being drawn is never changed under it. Events queue up separately,
+    # so a frame the renderer skips loses no sounds or puffs.
+    def __init__(self):
+        self.slots = [None, None]
+        self.front = 0
+        self.lock = threading.Lock()
+        self.events = deque()
+        self.steps = 0  # steps published so far
+
+    def publish(self, snapshot, events, steps):
+        back = 1 - self.front
+        self.slots[back] = snapshot
+        self.events.extend(events)
+        with self.lock:
+            self.front = back
+            self.steps += steps
+
+    def latest(self):
+        with self.lock:
+            return self.slots[self.front]
+
+    def take_events(self):
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
+
+class FrameState:
+    # The renderer's stand-in for a GameState in the pipelined loop: holds what
+    # GameView reads, copied from the newest FrameSnapshot
+    def __init__(self, snap):
+        self.player = Player(PLAYER_START_X, HEIGHT - GROUND_HEIGHT)  # only drawn, never updated
+        self.cubes = []
+        self.coins = []
+        self.apply(snap)
+
+    @property
+    def finished(self):
+        return self.game_over or self.win
+
+    def apply(self, snap):
+        self.snapshot = snap
+        p = self.player
+        p.prev_x, p.prev_y, p.x, p.y, p.on_ground, p.facing_right = snap.player
+        p.rect.topleft = (int(p.x), int(p.y))
+        for name in ("score", "lives", "timer", "combo", "equation_text", "current_level",
+                     "show_level_intro", "game_over", "win"):
+            setattr(self, name, getattr(snap, name))
+        # New cube and coin objects only when the level's set changes, so
+        # their cached labels survive from frame to frame
+        if [c.value for c in self.cubes] != [value for _, _, value, _ in snap.cubes]:
+            self.cubes = [AnswerCube(x, y + CUBE_H, value) for x, y, value, _ in snap.cubes]
+        for cube, (x, y, _, flash_alpha) in zip(self.cubes, snap.cubes):
+            cube.rect.topleft = (x, y)
+            cube.flash_alpha = flash_alpha
+        if len(self.coins) != len(snap.coins):
+            self.coins = [Coin(x, y + COIN_H) for x, y in snap.coins]
+        for coin, pos in zip(self.coins, snap.coins):
+            coin.rect.topleft = pos
+
+    def alpha(self, now):
+        # How far past the snapshot's step to draw the player
+        return min(1.0, max(0.0, (now - self.snapshot.at) / SIM_DT))
+
+
+class SimulationThread:
+    # Pipelined mode: steps a Session at SIM_HZ on its own thread and publishes
+    # a FrameSnapshot after each batch of steps. The main thread keeps the
+    # window, since SDL wants events and flips there. It feeds inputs in
+    # through an InputLatch and draws the newest frame. Blits, scaling and
+    # numpy release the GIL, and on a free-threaded build so does everything
+    # else, so a frame can take close to the slower of the two halves instead
+    # of their sum.
+    def __init__(self, session):
+        self.session = session
+        self.inputs = InputLatch()
+        self.frames = FrameBuffer()
+        self.frames.publish(session.state.frame(time.perf_counter()), (), 0)
+        self.running = threading.Event()  # cleared while the game loop is idle
+        self.running.set()
+        self.stopping = False
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="simulation", daemon=True)
+        self.thread.start()
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def stop(self):
+        self.stopping = True
+        self.running.set()
+        self.thread.join()
+
+    def _run(self):
+        state = self.session.state
+        acc = 0.0
+        last = time.perf_counter()
+        try:
+            while not self.stopping:
+                if not self.running.is_set():
+                    # Paused time doesn't count, like a minimised window in the plain loop
+                    self.running.wait()
+                    last = time.perf_counter()
+                    continue
+                now = time.perf_counter()
+                acc += min(now - last, MAX_FRAME_TIME)
+                last = now
+                events = []
+                steps = 0
+                while acc >= SIM_DT:
+                    events.extend(self.session.step(self.inputs.take()))
+                    acc -= SIM_DT
+                    steps += 1
+                if steps:
+                    self.frames.publish(state.frame(now - acc), events, steps)
+                time.sleep(SIM_DT - acc)
+        except BaseException as e:
+            # Re-raised on the main thread by the game loop
+            self.error = e
+
+
+def game_loop(screen, clock, background=None, profiler=None, endless=False, replay_dir=None,
+              scores=None, player_name=None, telemetry=None, bank=None, topic=None, governor=None,
+              pipelined=PIPELINED):
+    seed = random.getrandbits(32)
+    state = GameState(seed=seed, endless=endless, bank=bank, topic=topic)
+    view = GameView(background)
+    recorder = None
+    if replay_dir is not None:
+        # Seed + per-tick inputs is enough to play the session back (see replay.py)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{seed:08x}.mrr"
+        recorder = ReplayRecorder(os.path.join(replay_dir, name), seed, endless, SIM_HZ,
+                                  question_bank=bank is not None)
+    session = Session(state, seed, endless, recorder, scores, player_name, telemetry)
+    if profiler is None:
+        profiler = FrameProfiler(phases=PROFILE_PHASES)
+    debug = DebugOverlay(profiler, clock)
+    if governor is None:
+        governor = QualityGovernor()
+    view.set_quality(governor.quality)
+
+    # Rules advance in fixed SIM_DT steps; rendering runs at whatever rate
+    # RENDER_FPS and the display allow, drawing the player between steps.
+    # Pipelined, the steps run on a SimulationThread and `shown` mirrors its frames.
+    sim = SimulationThread(session) if pipelined else None
+    shown = FrameState(sim.frames.latest()) if pipelined else state
+    steps_drawn = 0
+    acc = 0.0
+    last = time.perf_counter()
+    pending_jump = pending_release = False  # key presses not yet seen by a step
+    window = WindowState()
+    static = False  # the last frame presented is final until something happens
+
+    try:
+        while True:
+            if static or window.minimised:
+                # Nothing to animate: sleep until input arrives
+                if sim is not None:
+                    sim.pause()
+                events = [pygame.event.wait(IDLE_WAIT_MS)] + pygame.event.get()
+            else:
+                clock.tick(RENDER_FPS if window.focused else UNFOCUSED_FPS)
+                events = pygame.event.get()
+            now = time.perf_counter()
+            frame_time = min(now - last, MAX_FRAME_TIME)
+            last = now
+            profiler.begin_frame()
+
+            was_minimised = window.minimised
+            for event in events:
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    sys.exit()
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE:
+                        return "exit"
+                    if event.key == pygame.K_r and shown.finished:
+                        return "restart"
+                    if event.key == pygame.K_F3:
+                        debug.toggle()
+                        static = False
+                window.handle(event)
+            if window.minimised:
+                # Paused while minimised: the level timer waits too
+                continue
+            if was_minimised:
+                frame_time = 0.0
+            if static:
+                if window.exposed:
+                    DISPLAY.flip()  # the finished frame is still on the screen surface
+                    window.exposed = False
+                continue
+            inputs = read_inputs(events)
+
+            if sim is None:
+                acc += frame_time
+                pending_jump = pending_jump or inputs.jump
+                pending_release = pending_release or inputs.release_jump
+                profiler.mark("events")
+                steps = 0
+                game_events = []
+                while acc >= SIM_DT:
+                    inputs = inputs._replace(jump=pending_jump, release_jump=pending_release)
+                    pending_jump = pending_release = False
+                    game_events.extend(session.step(inputs, profiler.mark))
+                    acc -= SIM_DT
+                    steps += 1
+                alpha = acc / SIM_DT
+            else:
+                if sim.error is not None:
+                    raise sim.error
+                sim.resume()
+                sim.inputs.push(inputs)
+                profiler.mark("events")
+                snap = sim.frames.latest()
+                if snap is not shown.snapshot:
+                    shown.apply(snap)
+                game_events = sim.frames.take_events()
+                steps = sim.frames.steps - steps_drawn
+                steps_drawn += steps
+                alpha = shown.alpha(time.perf_counter())
+            view.handle_events(game_events)
+            view.update(shown, frame_time)
+            profiler.mark("effects")
+
+            # --- Draw everything ---
+            if window.exposed and view.dirty is not None:
+                view.dirty.invalidate()
+            view.draw_background(screen)
+            profiler.mark("background")
+            view.draw_entities(screen, shown, alpha)
+            profiler.mark("entities")
+            view.draw_hud(screen, shown)
+            profiler.mark("hud")
+            view.draw_overlays(screen, shown)
+            profiler.mark("overlays")
+            if debug.visible and view.dirty is not None:
+                view.dirty.add(debug.rect)
+            debug.draw(screen)
+            profiler.mark("debug")
+            view.present()
+            profiler.mark("flip")
+
+            sample = profiler.end_frame(dt_ms=frame_time * 1000, sim_steps=steps,
+                                        fps=clock.get_fps(), puffs=view.particles.count(),
+                                        coins=len(shown.coins),
+                                        floating_texts=len(view.floating_texts),
+                                        text_cache_hit_rate=TEXT_CACHE.hit_rate(),
+                                        audio_voices=AUDIO.busy(), quality=governor.level)
+            if governor.add(sample["total_ms"]):
+                view.set_quality(governor.quality)
+                print(f"Quality: {governor.quality.name} (90% of frames within {governor.p90:.1f} ms)")
+            window.exposed = False
+            # Once the game is over and its effects have died down, stop drawing
+            # (the debug overlay keeps the loop running while it is up)
+            static = shown.finished and view.settled() and not debug.visible
+    finally:
+        if sim is not None:
+            sim.stop()
+        if recorder is not None:
+            recorder.close()
 
 # ----- Menu -----
-def menu(screen, clock):
+def menu(screen, clock, dirty_rects=DIRTY_RECT_RENDERING):
     selected = 0
-    options = ["Start","Exit"]
+    options = ["Start","Endless","Exit"]
+    drawn = None  # selection currently on screen
+    window = WindowState()
     while True:
-        screen.fill(BG)
-        draw_text(screen, "MATH RUNNER - v0.1", FONT_BIG, WIDTH//2, HEIGHT//4, center=True)
-        draw_text(screen, "© Taki Tech Games - 2025", FONT_SMALL, 400, 400, center=True, color=NAME_COLOR)
-        for i, option in enumerate(options):
-            color = HIGHLIGHT_COLOR if i==selected else TEXT_COLOR
-            draw_text(screen, option, FONT_MED, WIDTH//2, HEIGHT//2 + i*60, center=True, color=color)
-        pygame.display.flip()
-
-        for event in pygame.event.get():
+        if window.exposed:
+            drawn = None
+            window.exposed = False
+        if drawn is None or (drawn != selected and not dirty_rects):
+            screen.fill(BG)
+            draw_text(screen, "MATH RUNNER - v0.1", FONT_BIG, WIDTH//2, HEIGHT//4, center=True)
+            draw_text(screen, "© Taki Tech Games - 2025", FONT_SMALL, 400, 400, center=True, color=NAME_COLOR)
+            for i, option in enumerate(options):
+                color = HIGHLIGHT_COLOR if i==selected else TEXT_COLOR
+                draw_text(screen, option, FONT_MED, WIDTH//2, HEIGHT//2 + i*60, center=True, color=color)
+            DISPLAY.flip()
+            drawn = selected
+        elif drawn != selected:
+            # Only the two options whose highlight changed
+            rects = []
+            for i in (drawn, selected):
+                pos = (WIDTH//2, HEIGHT//2 + i*60)
+                screen.fill(BG, TEXT_CACHE.render(FONT_MED, options[i]).get_rect(center=pos))
+                color = HIGHLIGHT_COLOR if i==selected else TEXT_COLOR
+                rects.append(draw_text(screen, options[i], FONT_MED, pos[0], pos[1], center=True, color=color))
+            DISPLAY.update(rects)
+            drawn = selected
+
+        # The menu only changes on input, so it sleeps until there is some
+        # (music keeps playing on the mixer's own thread)
+        events = [pygame.event.wait(IDLE_WAIT_MS)] + pygame.event.get()
+        for event in events:
+            window.handle(event)
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
@@ -632,24 +2311,75 @@ def menu(screen, clock):
                 elif event.key in (pygame.K_RETURN, pygame.K_SPACE):
                     if options[selected]=="Start":
                         return "start"
+                    elif options[selected]=="Endless":
+                        return "endless"
                     elif options[selected]=="Exit":
                         pygame.quit()
                         sys.exit()
-        clock.tick(FPS)
 
 # ----- Main -----
 def main():
-    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    init_pygame()
+    screen = DISPLAY.open()
     pygame.display.set_caption("Math Runner - v0.1 | Taki Tech Games")
     clock = pygame.time.Clock()
-    while True:
-        choice = menu(screen, clock)
-        if choice=="start":
-            result = game_loop(screen, clock)
-            if result=="exit":
+    window_shown = time.perf_counter()
+
+    ASSETS.start()
+    loading_screen(screen, clock, ASSETS)
+    assets_loaded = time.perf_counter()
+    background = Background()
+    AUDIO.setup(ASSETS.sounds)
+    ASSETS.play_music()
+    ready = time.perf_counter()
+    slowest = max(ASSETS.timings, key=ASSETS.timings.get)
+    print(f"Startup: window {window_shown - STARTUP_T0:.2f}s, "
+          f"assets {assets_loaded - window_shown:.2f}s (slowest {slowest} "
+          f"{ASSETS.timings[slowest]:.2f}s), ready {ready - STARTUP_T0:.2f}s")
+
+    # MATH_RUNNER_PROFILE=frames.jsonl (or .csv) streams per-frame phase timings to a file
+    profiler = FrameProfiler(phases=PROFILE_PHASES)
+    governor = QualityGovernor()  # kept across sessions, like the profiler
+    profile_path = os.environ.get("MATH_RUNNER_PROFILE")
+    if profile_path:
+        profiler.attach_writer(SampleWriter(profile_path))
+    # MATH_RUNNER_RECORD=replays/ saves every session there as a replay
+    replay_dir = os.environ.get("MATH_RUNNER_RECORD")
+    if replay_dir:
+        os.makedirs(replay_dir, exist_ok=True)
+    scores = HighscoreRepository(SCORES_PATH)
+    player_name = os.environ.get("MATH_RUNNER_PLAYER")
+    # MATH_RUNNER_TELEMETRY=telemetry/ logs every answer there (see telemetry.py)
+    telemetry_dir = os.environ.get("MATH_RUNNER_TELEMETRY")
+    telemetry = TelemetryLog(telemetry_dir) if telemetry_dir else None
+    pipelined = PIPELINED or os.environ.get("MATH_RUNNER_PIPELINE") == "1"
+    # Questions come from the bank when there is one; MATH_RUNNER_TOPIC=fractions limits them to a topic
+    bank = QuestionBank(QUESTION_BANK_PATH) if os.path.exists(QUESTION_BANK_PATH) else None
+    topic = os.environ.get("MATH_RUNNER_TOPIC") or None
+    if topic is not None and (bank is None or topic not in bank.topics):
+        print(f"No questions in topic {topic!r}, using all topics")
+        topic = None
+
+    try:
+        while True:
+            choice = menu(screen, clock)
+            if choice in ("start", "endless"):
+                result = game_loop(screen, clock, background, profiler,
+                                   endless=(choice=="endless"), replay_dir=replay_dir or None,
+                                   scores=scores, player_name=player_name, telemetry=telemetry,
+                                   bank=bank, topic=topic, governor=governor,
+                                   pipelined=pipelined)
+                if result=="exit":
+                    break
+            else:
                 break
-        else:
-            break
+    finally:
+        profiler.close()
+        scores.close()
+        if telemetry is not None:
+            telemetry.close()
+        if bank is not None:
+            bank.close()
     pygame.quit()
     sys.exit()
 
@@ -0,0 +1,122 @@
+"""Frame-phase timing for the game loop.
+
+The loop calls begin_frame(), then mark("phase") after each phase and
+end_frame() at the end of the tick. Every finished frame becomes a sample
+dict. It is kept in a rolling history, passed to any registered hooks, and
+written to a CSV or JSONL file on a background thread when a SampleWriter
+is attached. Phases named up front are in every sample, at 0 ms on frames
+that skip them, so a CSV header taken from the first sample has all the
+columns.
+"""
+import csv
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+HISTORY_FRAMES = 240
+
+
+class FrameProfiler:
+    def __init__(self, history=HISTORY_FRAMES, phases=()):
+        self.known_phases = tuple(phases)  # always reported, in this order
+        self.history = deque(maxlen=history)  # total frame work in ms, for the graph
+        self.phase_history = {}  # phase name -> deque of ms
+        self.hooks = []
+        self.writer = None
+        self.frame = 0
+        self.phases = {}
+        self._frame_start = 0.0
+        self._last = 0.0
+        self.last_sample = None
+
+    def add_hook(self, fn):
+        # fn(sample) is called on the game thread after every frame
+        self.hooks.append(fn)
+
+    def remove_hook(self, fn):
+        self.hooks.remove(fn)
+
+    def attach_writer(self, writer):
+        self.writer = writer
+
+    def begin_frame(self):
+        self.phases = dict.fromkeys(self.known_phases, 0.0)
+        self._frame_start = self._last = time.perf_counter()
+
+    def mark(self, phase):
+        # Time since the previous mark (or begin_frame) is booked to `phase`
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+    def end_frame(self, **extra):
+        total = (time.perf_counter() - self._frame_start) * 1000
+        self.frame += 1
+        self.history.append(total)
+        for phase, ms in self.phases.items():
+            samples = self.phase_history.get(phase)
+            if samples is None:
+                samples = self.phase_history[phase] = deque(maxlen=self.history.maxlen)
+            samples.append(ms)
+
+        sample = {"frame": self.frame, "time": time.time(), "total_ms": total}
+        sample.update(self.phases)
+        sample.update(extra)
+        self.last_sample = sample
+        for fn in self.hooks:
+            fn(sample)
+        if self.writer is not None:
+            self.writer.write(sample)
+        return sample
+
+    def average(self, phase=None, frames=60):
+        samples = self.history if phase is None else self.phase_history.get(phase, ())
+        n = min(frames, len(samples))
+        if n == 0:
+            return 0.0
+        return sum(samples[i] for i in range(len(samples) - n, len(samples))) / n
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class SampleWriter:
+    # Streams samples to disk on a daemon thread; .csv gets a header row, anything else is JSONL
+    def __init__(self, path, flush_every=60):
+        self.path = path
+        self.flush_every = flush_every
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name="profiler-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, sample):
+        self.queue.put(sample)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        csv_mode = self.path.lower().endswith(".csv")
+        with open(self.path, "w", newline="") as f:
+            writer = None
+            pending = 0
+            while True:
+                sample = self.queue.get()
+                if sample is None:
+                    break
+                if csv_mode:
+                    if writer is None:
+                        writer = csv.DictWriter(f, fieldnames=list(sample), extrasaction="ignore")
+                        writer.writeheader()
+                    writer.writerow(sample)
+                else:
+                    f.write(json.dumps(sample) + "\n")
+                pending += 1
+                if pending >= self.flush_every:
+                    f.flush()
+                    pending = 0
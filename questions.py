@@ -0,0 +1,254 @@
+"""Question bank: questions compiled into one indexed file that is memory-mapped.
+
+    python questions.py build questions.qbank curriculum/*.csv extra.json
+    python questions.py info questions.qbank
+    python questions.py sample questions.qbank --topic fractions --difficulty 3 -n 5
+
+Sources are CSV files with a header row (topic, difficulty, question, answer,
+and one or more columns whose names start with "wrong"), or JSON/JSON Lines
+files of objects with topic, difficulty, question, answer and wrongs. Answers
+are integers, the same as the values on the cubes.
+
+Layout: an 8-byte magic, then a little-endian u32 with the JSON index length
+and a u64 with the question count. Next comes the JSON index, followed by
+count + 1 u64 record offsets. The records come last. A record is the correct
+answer (i64), the number of wrong answers (u8), that many i64s, and then the
+question text in UTF-8 up to the next offset. The builder sorts questions by
+(difficulty, topic). Every difficulty, and every topic within it, is then one
+contiguous run of records. The index maps each of them to (first, count).
+
+QuestionBank maps the file read-only and only reads the index up front. A
+random question is one randrange() and one record read, whatever the size
+of the bank. Processes that open the same bank share its pages.
+"""
+import argparse
+import csv
+import json
+import mmap
+import os
+import random
+import struct
+from collections import defaultdict
+
+MAGIC = b"MRQBANK1"
+HEADER = struct.Struct("<8sIQ")  # magic, index length, question count
+OFFSET = struct.Struct("<Q")
+RECORD = struct.Struct("<qB")  # correct answer, wrong answer count
+ANSWER = struct.Struct("<q")
+MAX_WRONGS = 255
+
+
+def _align(n, to=8):
+    return (n + to - 1) // to * to
+
+
+def _int(value, where, field):
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{where}: {field} {value!r} is not an integer") from None
+
+
+def _question(row, where):
+    # One source row -> (difficulty, topic, text, correct, wrongs)
+    if not isinstance(row, dict):
+        raise ValueError(f"{where}: expected an object, not {row!r}")
+    text = str(row.get("question") or "").strip()
+    if not text:
+        raise ValueError(f"{where}: missing question")
+    topic = str(row.get("topic") or "").strip()
+    difficulty = _int(row.get("difficulty", 1), where, "difficulty")
+    correct = _int(row.get("answer"), where, "answer")
+    wrongs = row.get("wrongs") or []
+    if not isinstance(wrongs, list):
+        raise ValueError(f"{where}: wrongs must be a list, not {wrongs!r}")
+    wrongs = [_int(w, where, "wrong answer") for w in wrongs]
+    if not wrongs:
+        raise ValueError(f"{where}: no wrong answers")
+    if correct in wrongs:
+        raise ValueError(f"{where}: answer {correct} is also listed as wrong")
+    if len(wrongs) > MAX_WRONGS:
+        raise ValueError(f"{where}: more than {MAX_WRONGS} wrong answers")
+    return difficulty, topic, text, correct, wrongs
+
+
+def read_source(path):
+    # Yields (difficulty, topic, text, correct, wrongs) for every question in a CSV/JSON/JSONL file
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            wrong_columns = [c for c in reader.fieldnames or () if c.lower().startswith("wrong")]
+            for row in reader:
+                row["wrongs"] = [row[c] for c in wrong_columns if row[c] and row[c].strip()]
+                yield _question(row, f"{path}:{reader.line_num}")
+    elif ext == ".jsonl":
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    yield _question(json.loads(line), f"{path}:{line_no}")
+    elif ext == ".json":
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+        for i, row in enumerate(rows):
+            yield _question(row, f"{path}[{i}]")
+    else:
+        raise ValueError(f"{path}: expected a .csv, .json or .jsonl file")
+
+
+def build_bank(out_path, sources):
+    # sources: paths of CSV/JSON/JSONL files; returns the index
+    questions = []
+    for path in sources:
+        for difficulty, topic, text, correct, wrongs in read_source(path):
+            record = (RECORD.pack(correct, len(wrongs)) + b"".join(ANSWER.pack(w) for w in wrongs)
+                      + text.encode())
+            questions.append((difficulty, topic, record))
+    questions.sort(key=lambda q: (q[0], q[1]))
+
+    # (first, count) for each difficulty, and for each topic within it
+    difficulties = {}
+    topics = defaultdict(dict)
+    for i, (difficulty, topic, _) in enumerate(questions):
+        first, count = difficulties.get(difficulty, (i, 0))
+        difficulties[difficulty] = (first, count + 1)
+        first, count = topics[topic].get(difficulty, (i, 0))
+        topics[topic][difficulty] = (first, count + 1)
+    index = {"difficulties": difficulties, "topics": topics}
+    index_bytes = json.dumps(index, sort_keys=True).encode()
+
+    offsets_start = _align(HEADER.size + len(index_bytes))
+    with open(out_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(index_bytes), len(questions)))
+        f.write(index_bytes)
+        f.write(bytes(offsets_start - f.tell()))
+        offset = 0
+        for _, _, record in questions:
+            f.write(OFFSET.pack(offset))
+            offset += len(record)
+        f.write(OFFSET.pack(offset))
+        for _, _, record in questions:
+            f.write(record)
+    return index
+
+
+class QuestionBank:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_len, self.count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a question bank")
+        index = json.loads(self.map[HEADER.size:HEADER.size + index_len])
+        # JSON keys are strings; difficulties are ints
+        self.difficulties = {int(d): tuple(r) for d, r in index["difficulties"].items()}
+        self.topics = {topic: {int(d): tuple(r) for d, r in groups.items()}
+                       for topic, groups in index["topics"].items()}
+        self.offsets_start = _align(HEADER.size + index_len)
+        self.records_start = self.offsets_start + OFFSET.size * (self.count + 1)
+
+    def __len__(self):
+        return self.count
+
+    def question(self, i):
+        # Record i as a level: (text, correct, wrongs)
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        start, end = struct.unpack_from("<2Q", self.map, self.offsets_start + OFFSET.size * i)
+        start += self.records_start
+        end += self.records_start
+        correct, wrong_count = RECORD.unpack_from(self.map, start)
+        wrongs_at = start + RECORD.size
+        wrongs = list(struct.unpack_from(f"<{wrong_count}q", self.map, wrongs_at))
+        text = self.map[wrongs_at + ANSWER.size * wrong_count:end].decode()
+        return text, correct, wrongs
+
+    def available(self, topic=None):
+        # Difficulties with questions, optionally in one topic only, easiest first
+        groups = self.difficulties if topic is None else self.topics.get(topic, {})
+        return sorted(groups)
+
+    def group(self, difficulty, topic=None):
+        groups = self.difficulties if topic is None else self.topics.get(topic, {})
+        return groups.get(difficulty, (0, 0))
+
+    def random(self, rng, difficulty, topic=None, exclude=None):
+        # A random record index at this difficulty (and topic); exclude avoids an immediate repeat
+        first, count = self.group(difficulty, topic)
+        if not count:
+            raise KeyError(f"no questions at difficulty {difficulty}"
+                           + (f" in topic {topic!r}" if topic is not None else ""))
+        i = first + rng.randrange(count)
+        if i == exclude and count > 1:
+            i = first + (i - first + 1 + rng.randrange(count - 1)) % count
+        return i
+
+    def levels(self, rng, topic=None, start_difficulty=1, levels_per_difficulty=3, wrong_count=None):
+        # Infinite level stream like main.endless_levels: the difficulty goes up
+        # every levels_per_difficulty levels, through the difficulties the bank has.
+        # Questions with more than wrong_count wrong answers get a random wrong_count of them.
+        available = self.available(topic)
+        if not available:
+            raise KeyError(f"no questions in topic {topic!r}")
+        level = 0
+        last = None
+        while True:
+            target = start_difficulty + level // levels_per_difficulty
+            difficulty = max((d for d in available if d <= target), default=available[0])
+            last = self.random(rng, difficulty, topic, exclude=last)
+            text, correct, wrongs = self.question(last)
+            if wrong_count is not None and len(wrongs) > wrong_count:
+                wrongs = rng.sample(wrongs, wrong_count)
+            yield text, correct, wrongs
+            level += 1
+
+    def close(self):
+        self.map.close()
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="compile CSV/JSON/JSONL sources into a bank")
+    build.add_argument("out")
+    build.add_argument("sources", nargs="+")
+    info = sub.add_parser("info", help="questions per difficulty and topic")
+    info.add_argument("path")
+    sample = sub.add_parser("sample", help="print random questions")
+    sample.add_argument("path")
+    sample.add_argument("--topic")
+    sample.add_argument("--difficulty", type=int)
+    sample.add_argument("-n", type=int, default=5)
+    sample.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        try:
+            index = build_bank(args.out, args.sources)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        total = sum(count for _, count in index["difficulties"].values())
+        print(f"{args.out}: {total} questions, {len(index['topics'])} topics, "
+              f"{len(index['difficulties'])} difficulties, {os.path.getsize(args.out) / 1024:.0f} KiB")
+    elif args.command == "info":
+        bank = QuestionBank(args.path)
+        print(f"{args.path}: {len(bank)} questions")
+        for topic, groups in sorted(bank.topics.items()):
+            counts = "  ".join(f"d{d}: {count}" for d, (_, count) in sorted(groups.items()))
+            print(f"  {topic or '-':<20} {counts}")
+    elif args.command == "sample":
+        bank = QuestionBank(args.path)
+        rng = random.Random(args.seed)
+        difficulties = bank.available(args.topic)
+        if args.difficulty is not None:
+            difficulties = [d for d in difficulties if d == args.difficulty]
+        if not difficulties:
+            parser.error("no questions match")
+        for _ in range(args.n):
+            text, correct, wrongs = bank.question(bank.random(rng, rng.choice(difficulties), args.topic))
+            print(f"{text}  -> {correct}  (wrong: {', '.join(map(str, wrongs))})")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,265 @@
+"""Input replays: a session stored as its seed plus one input bitmask per tick.
+
+    python replay.py info replays/session.mrr
+    python replay.py run replays/session.mrr
+    python replay.py watch replays/session.mrr --speed 4 --seek 30
+
+GameState is deterministic for a given seed and input sequence, so nothing
+else is needed to reproduce a session. After a fixed header (magic, version,
+flags, tick rate, seed) the file holds (mask, count) byte pairs: `count`
+consecutive ticks with the same input bitmask. A held direction costs two
+bytes no matter how long it is held. A file cut short by a crash still plays
+up to the last pair written.
+
+Sessions that drew their questions from a question bank are flagged. They
+need the same bank (and topic) to play back: --bank and --topic.
+
+ReplayPlayer steps a GameState through a replay as fast as the machine
+allows. It takes a GameState.snapshot() every SNAPSHOT_SECONDS, so seek()
+only has to restore the nearest snapshot and re-simulate a few seconds.
+"""
+import argparse
+import os
+import queue
+import struct
+import threading
+import time
+
+from questions import QuestionBank
+
+MAGIC = b"MRREPLAY"
+VERSION = 1
+HEADER = struct.Struct("<8sBBHQ")  # magic, version, flags, sim rate (Hz), seed
+FLAG_ENDLESS = 1
+FLAG_QUESTION_BANK = 2
+MAX_RUN = 255
+CHUNK_BYTES = 4096  # encoded bytes handed to the writer thread at a time
+SNAPSHOT_SECONDS = 5.0
+
+# Input bitmask
+LEFT, RIGHT, JUMP, RELEASE_JUMP = 1, 2, 4, 8
+
+
+def encode(inputs):
+    return (inputs.left * LEFT | inputs.right * RIGHT | inputs.jump * JUMP
+            | inputs.release_jump * RELEASE_JUMP)
+
+
+def decode_table(inputs_type):
+    # mask -> inputs_type(left, right, jump, release_jump), for all 16 masks
+    return tuple(inputs_type(bool(m & LEFT), bool(m & RIGHT), bool(m & JUMP), bool(m & RELEASE_JUMP))
+                 for m in range(16))
+
+
+class ReplayRecorder:
+    # record() is called once per simulation tick on the game thread; the
+    # file is written on a daemon thread
+    def __init__(self, path, seed, endless, sim_hz, question_bank=False):
+        self.path = path
+        self.mask = None
+        self.run = 0
+        self.ticks = 0
+        self.pending = bytearray()
+        self.queue = queue.SimpleQueue()
+        flags = (FLAG_ENDLESS if endless else 0) | (FLAG_QUESTION_BANK if question_bank else 0)
+        self.queue.put(HEADER.pack(MAGIC, VERSION, flags, sim_hz, seed))
+        self.thread = threading.Thread(target=self._run, name="replay-writer", daemon=True)
+        self.thread.start()
+
+    def record(self, inputs):
+        mask = encode(inputs)
+        self.ticks += 1
+        if mask == self.mask and self.run < MAX_RUN:
+            self.run += 1
+            return
+        if self.run:
+            self.pending += bytes((self.mask, self.run))
+            if len(self.pending) >= CHUNK_BYTES:
+                self.queue.put(bytes(self.pending))
+                self.pending.clear()
+        self.mask = mask
+        self.run = 1
+
+    def close(self):
+        if self.run:
+            self.pending += bytes((self.mask, self.run))
+            self.run = 0
+        if self.pending:
+            self.queue.put(bytes(self.pending))
+            self.pending.clear()
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        with open(self.path, "wb") as f:
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    break
+                f.write(data)
+
+
+class Replay:
+    def __init__(self, seed, endless, sim_hz, masks=b"", question_bank=False):
+        self.seed = seed
+        self.endless = endless
+        self.sim_hz = sim_hz
+        self.masks = masks  # one byte per tick
+        self.question_bank = question_bank
+
+    def __len__(self):
+        return len(self.masks)
+
+    @property
+    def duration(self):
+        return len(self.masks) / self.sim_hz
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ValueError(f"{path} is not a replay")
+        magic, version, flags, sim_hz, seed = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a replay")
+        if version != VERSION:
+            raise ValueError(f"{path}: unsupported replay version {version}")
+        body = data[HEADER.size:]
+        # An odd trailing byte is half a pair from an interrupted write
+        masks = b"".join(bytes((body[i],)) * body[i + 1] for i in range(0, len(body) - 1, 2))
+        return cls(seed, bool(flags & FLAG_ENDLESS), sim_hz, masks, bool(flags & FLAG_QUESTION_BANK))
+
+
+class ReplayPlayer:
+    def __init__(self, replay, snapshot_seconds=SNAPSHOT_SECONDS, bank=None, topic=None):
+        import main
+        if replay.sim_hz != main.SIM_HZ:
+            raise ValueError(f"replay was recorded at {replay.sim_hz} Hz, the game runs at {main.SIM_HZ} Hz")
+        if replay.question_bank and bank is None:
+            raise ValueError("replay was recorded with a question bank; pass the same bank")
+        self.replay = replay
+        self.dt = 1.0 / replay.sim_hz
+        self.inputs = decode_table(main.Inputs)
+        self.snapshot_every = max(1, round(snapshot_seconds * replay.sim_hz))
+        self.state = main.GameState(seed=replay.seed, endless=replay.endless,
+                                    bank=bank if replay.question_bank else None, topic=topic)
+        self.tick = 0
+        self.snapshots = [self.state.snapshot()]  # snapshots[i] is at tick i * snapshot_every
+
+    @property
+    def done(self):
+        return self.tick >= len(self.replay)
+
+    def step(self):
+        # One recorded tick; returns its events
+        events = self.state.step(self.inputs[self.replay.masks[self.tick]], self.dt)
+        self.tick += 1
+        if self.tick % self.snapshot_every == 0 and self.tick // self.snapshot_every == len(self.snapshots):
+            self.snapshots.append(self.state.snapshot())
+        return events
+
+    def run(self, ticks=None):
+        end = len(self.replay) if ticks is None else min(len(self.replay), self.tick + ticks)
+        while self.tick < end:
+            self.step()
+
+    def seek(self, tick):
+        tick = max(0, min(len(self.replay), tick))
+        nearest = min(tick // self.snapshot_every, len(self.snapshots) - 1)
+        if tick < self.tick or nearest * self.snapshot_every > self.tick:
+            self.state.restore(self.snapshots[nearest])
+            self.tick = nearest * self.snapshot_every
+        self.run(tick - self.tick)
+
+
+def watch(replay, speed=1.0, seek=0.0, bank=None, topic=None):
+    # Plays a replay in a window. Left/right jump 10 s, space pauses, up/down change speed
+    import main
+    main.init_pygame(audio=False)
+    screen = main.DISPLAY.open()
+    main.pygame.display.set_caption("Math Runner - replay")
+    clock = main.pygame.time.Clock()
+    main.ASSETS.load(audio=False)
+    background = main.Background()
+    player = ReplayPlayer(replay, bank=bank, topic=topic)
+    player.seek(round(seek * replay.sim_hz))
+    view = main.GameView(background)
+    paused = False
+    acc = 0.0
+    while True:
+        frame_time = min(clock.tick(main.RENDER_FPS) / 1000.0, main.MAX_FRAME_TIME)
+        for event in main.pygame.event.get():
+            if event.type == main.pygame.QUIT:
+                return
+            if event.type != main.pygame.KEYDOWN:
+                continue
+            if event.key == main.pygame.K_ESCAPE:
+                return
+            elif event.key == main.pygame.K_SPACE:
+                paused = not paused
+            elif event.key == main.pygame.K_UP:
+                speed *= 2
+            elif event.key == main.pygame.K_DOWN:
+                speed /= 2
+            elif event.key in (main.pygame.K_LEFT, main.pygame.K_RIGHT):
+                jump = 10 if event.key == main.pygame.K_RIGHT else -10
+                player.seek(player.tick + jump * replay.sim_hz)
+                view = main.GameView(background)
+                acc = 0.0
+
+        events = []
+        if not paused:
+            acc += frame_time * speed
+            while acc >= player.dt and not player.done:
+                events.extend(player.step())
+                acc -= player.dt
+        view.handle_events(events)
+        view.update(player.state, 0.0 if paused else frame_time)
+        view.draw(screen, player.state, min(1.0, acc / player.dt))
+        main.draw_text(screen, f"{player.tick / replay.sim_hz:6.1f}s / {replay.duration:.1f}s  x{speed:g}"
+                       + ("  paused" if paused else ""), main.FONT_SMALL, 10, main.HEIGHT - 24)
+        main.DISPLAY.flip()
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info", help="header and length")
+    info.add_argument("path")
+    run = sub.add_parser("run", help="simulate headless and print the outcome")
+    run.add_argument("path")
+    watch_cmd = sub.add_parser("watch", help="play back in a window")
+    watch_cmd.add_argument("path")
+    watch_cmd.add_argument("--speed", type=float, default=1.0)
+    watch_cmd.add_argument("--seek", type=float, default=0.0, help="start this many seconds in")
+    for p in (run, watch_cmd):
+        p.add_argument("--bank", help="question bank the session was played with")
+        p.add_argument("--topic")
+    args = parser.parse_args(argv)
+
+    replay = Replay.load(args.path)
+    bank = None
+    if getattr(args, "bank", None):
+        bank = QuestionBank(args.bank)
+    if args.command == "info":
+        print(f"{args.path}: seed {replay.seed}, {'endless' if replay.endless else 'levels'}"
+              f"{', question bank' if replay.question_bank else ''}, "
+              f"{len(replay)} ticks at {replay.sim_hz} Hz ({replay.duration:.1f}s), "
+              f"{os.path.getsize(args.path)} bytes")
+    elif args.command == "run":
+        player = ReplayPlayer(replay, bank=bank, topic=args.topic)
+        start = time.perf_counter()
+        player.run()
+        elapsed = time.perf_counter() - start
+        state = player.state
+        print(f"score {state.score}, lives {state.lives}, level {state.current_level + 1}, "
+              f"{'won' if state.win else 'game over' if state.game_over else 'unfinished'}")
+        print(f"{len(replay)} ticks in {elapsed:.2f}s "
+              f"({replay.duration / elapsed if elapsed else float('inf'):.0f}x real time)")
+    elif args.command == "watch":
+        watch(replay, args.speed, args.seek, bank, args.topic)
+
+
+if __name__ == "__main__":
+    main_cli()
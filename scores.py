@@ -0,0 +1,157 @@
+"""Finished-session results stored in SQLite, written off the game thread.
+
+    python scores.py top --mode endless -n 10
+    python scores.py player NAME
+
+The table is the Highscore relation from the database design document
+(id, score, createdAt, playerName), extended with what the session reached:
+level, best combo, length in seconds, mode and whether it was won.
+
+submit() only puts the result on a queue. A daemon thread owns the write
+connection. It takes whatever has queued up and commits it as one
+executemany() in one transaction, so the game thread never waits on disk,
+not even at game over. Queries run on a second connection held open for
+the process lifetime. Both use WAL, so reads do not wait for a commit.
+Statements are module-level constants, so each connection's statement
+cache prepares them once. Leaderboards are served by the two indexes below.
+"""
+import argparse
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS Highscore (
+    id INTEGER PRIMARY KEY,
+    score INTEGER NOT NULL,
+    createdAt TEXT NOT NULL,
+    playerName TEXT,
+    mode TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    combo INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    won INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS Highscore_top ON Highscore (mode, score DESC);
+CREATE INDEX IF NOT EXISTS Highscore_player ON Highscore (playerName, mode, score DESC);
+"""
+INSERT = ("INSERT INTO Highscore (score, createdAt, playerName, mode, level, combo, duration, won) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+COLUMNS = "score, createdAt, playerName, mode, level, combo, duration, won"
+TOP = f"SELECT {COLUMNS} FROM Highscore WHERE mode = ? ORDER BY score DESC LIMIT ?"
+PLAYER_TOP = (f"SELECT {COLUMNS} FROM Highscore WHERE playerName = ? AND mode = ? "
+              "ORDER BY score DESC LIMIT ?")
+
+BATCH_WINDOW = 0.25  # seconds the writer waits for more results before committing
+
+Score = namedtuple("Score", "score created_at player mode level combo duration won")
+
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent; a crash can lose the last commit
+    return conn
+
+
+class HighscoreRepository:
+    def __init__(self, path, batch_window=BATCH_WINDOW):
+        self.path = path
+        self.batch_window = batch_window
+        self.queue = queue.SimpleQueue()
+        self.pending = 0  # submitted but not yet committed
+        self.lock = threading.Lock()
+        self.committed = threading.Condition(self.lock)
+        self.written = 0
+        self.batches = 0
+        self.reader = connect(path)
+        self.reader.executescript(SCHEMA)
+        self.thread = threading.Thread(target=self._run, name="score-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, score, level, combo, duration, mode="levels", won=False, player=None):
+        # Never blocks: the row is written by the writer thread
+        created_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            self.pending += 1
+        self.queue.put((score, created_at, player, mode, level, combo, duration, int(won)))
+
+    def top(self, n=10, mode="levels"):
+        return [Score(*row) for row in self.reader.execute(TOP, (mode, n))]
+
+    def player_top(self, player, n=10, mode="levels"):
+        return [Score(*row) for row in self.reader.execute(PLAYER_TOP, (player, mode, n))]
+
+    def flush(self, timeout=None):
+        # Waits until everything submitted so far is committed
+        with self.committed:
+            return self.committed.wait_for(lambda: self.pending == 0, timeout)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.reader.close()
+
+    def _run(self):
+        conn = connect(self.path)
+        closing = False
+        while not closing:
+            rows = [self.queue.get()]
+            # Whatever else arrives shortly after goes into the same transaction
+            deadline = time.monotonic() + self.batch_window
+            while rows[-1] is not None:
+                timeout = deadline - time.monotonic()
+                try:
+                    rows.append(self.queue.get(timeout=timeout) if timeout > 0
+                                else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if rows[-1] is None:
+                closing = True
+                rows.pop()
+            if rows:
+                try:
+                    with conn:
+                        conn.executemany(INSERT, rows)
+                    self.written += len(rows)
+                    self.batches += 1
+                except sqlite3.Error as e:
+                    print(f"Could not save {len(rows)} score(s) to {self.path}: {e}", file=sys.stderr)
+            with self.committed:
+                self.pending -= len(rows)
+                self.committed.notify_all()
+        conn.close()
+
+
+def main_cli(argv=None):
+    import main
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=main.SCORES_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    top = sub.add_parser("top", help="best scores")
+    player = sub.add_parser("player", help="one player's best scores")
+    player.add_argument("name")
+    for p in (top, player):
+        p.add_argument("--mode", choices=("levels", "endless"), default="levels")
+        p.add_argument("-n", type=int, default=10)
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist yet")
+
+    repo = HighscoreRepository(args.db)
+    if args.command == "top":
+        rows = repo.top(args.n, args.mode)
+    else:
+        rows = repo.player_top(args.name, args.n, args.mode)
+    for i, s in enumerate(rows, 1):
+        print(f"{i:>3}. {s.score:>6}  {s.player or '-':<16} level {s.level:<3} combo {s.combo:<3} "
+              f"{s.duration:6.1f}s  {s.created_at}{'  won' if s.won else ''}")
+    repo.close()
+
+
+if __name__ == "__main__":
+    main_cli()
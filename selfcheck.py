@@ -0,0 +1,222 @@
+"""Round-trip checks for the file formats and the deterministic simulation.
+
+    python selfcheck.py
+    python selfcheck.py --seconds 120 --seed 7
+
+Runs headless and needs no game assets. Each check writes its files to a
+temporary directory:
+
+  replay    records bot sessions through Session.step, plays them back with
+            ReplayPlayer.run and compares the final GameState.snapshot().
+            seek() forwards and backwards has to match a fresh run to the
+            same tick, and a file cut off mid-pair has to load.
+  qbank     builds a bank from CSV and JSONL sources and reads every
+            question(i) back. Each difficulty/topic group has to hold only
+            its own questions, and levels() has to trim the wrong answers.
+            Then a session drawn from the bank goes through the replay check.
+  bundle    packs generated images and a sound into an asset bundle and
+            compares the pixels and PCM read back through the mapping.
+
+Exits with status 1 after the first check that fails.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+import wave
+from itertools import islice
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+
+import main
+from balance import POLICIES, Bot
+from bundle import Bundle, build_bundle
+from questions import QuestionBank, build_bank
+from replay import Replay, ReplayPlayer, ReplayRecorder
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def expect(ok, what):
+    if not ok:
+        raise CheckFailed(what)
+
+
+def record_session(path, seed, ticks, endless, bank=None, topic=None):
+    # A bot plays up to `ticks` steps the way game_loop runs them; returns the
+    # final snapshot and the number of ticks recorded
+    state = main.GameState(seed=seed, endless=endless, bank=bank, topic=topic)
+    recorder = ReplayRecorder(path, seed, endless, main.SIM_HZ, question_bank=bank is not None)
+    session = main.Session(state, seed, endless, recorder)
+    bot = Bot(POLICIES["average"], random.Random(seed))
+    recorded = 0
+    while recorded < ticks and not state.finished:
+        session.step(bot.inputs(state))
+        recorded += 1
+    recorder.close()
+    return state.snapshot(), recorded
+
+
+def check_replay(tmp, seed, ticks, bank=None, topic=None):
+    for endless in (False, True):
+        path = os.path.join(tmp, f"{seed:08x}-{int(endless)}.mrr")
+        live, ticks = record_session(path, seed, ticks, endless, bank, topic)
+        replay = Replay.load(path)
+        expect((replay.seed, replay.endless, replay.question_bank, len(replay))
+               == (seed, endless, bank is not None, ticks), f"{path}: header or length differs")
+
+        player = ReplayPlayer(replay, bank=bank, topic=topic)
+        player.run()
+        expect(player.state.snapshot() == live, f"{path}: playback ends in a different state")
+
+        # Off a snapshot boundary, forwards from the start and backwards from the end
+        for tick in (ticks * 2 // 3 + 1, ticks // 3 + 1):
+            player.seek(tick)
+            fresh = ReplayPlayer(replay, bank=bank, topic=topic)
+            fresh.run(tick)
+            expect(player.state.snapshot() == fresh.state.snapshot(),
+                   f"{path}: seek({tick}) differs from running to tick {tick}")
+        player.seek(ticks)
+        expect(player.state.snapshot() == live, f"{path}: seek back to the end differs")
+
+        # A writer killed mid-pair leaves an odd byte; the complete pairs still load
+        with open(path, "rb") as f:
+            data = f.read()
+        cut = os.path.join(tmp, "cut.mrr")
+        with open(cut, "wb") as f:
+            f.write(data[:-1])
+        expect(len(Replay.load(cut)) == ticks - data[-1], f"{cut}: truncated replay misread")
+
+
+def write_sources(tmp, rng):
+    # Returns the source paths and {text: (difficulty, topic, correct, wrongs)}
+    expected = {}
+    csv_path = os.path.join(tmp, "questions.csv")
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["topic", "difficulty", "question", "answer", "wrong1", "wrong2", "wrong3"])
+        for i in range(300):
+            topic, difficulty = rng.choice(("sums", "products", "")), rng.randint(1, 4)
+            a, b = rng.randint(-50, 50), rng.randint(1, 50)
+            text = f"{a} + {b} = ? #{i}"
+            wrongs = rng.sample([a + b + d for d in range(-9, 10) if d], 3)
+            writer.writerow([topic, difficulty, text, a + b] + wrongs)
+            expected[text] = (difficulty, topic, a + b, wrongs)
+    jsonl_path = os.path.join(tmp, "questions.jsonl")
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for i in range(200):
+            difficulty = rng.randint(2, 6)
+            correct = rng.randint(-2**40, 2**40)
+            wrongs = rng.sample([correct + d for d in range(1, 400)], rng.randint(1, 40))
+            text = f"törtek ÷ {i}"
+            f.write(json.dumps({"topic": "fractions", "difficulty": difficulty, "question": text,
+                                "answer": correct, "wrongs": wrongs}) + "\n")
+            expected[text] = (difficulty, "fractions", correct, wrongs)
+    return [csv_path, jsonl_path], expected
+
+
+def check_qbank(tmp, seed, ticks):
+    rng = random.Random(seed)
+    sources, expected = write_sources(tmp, rng)
+    path = os.path.join(tmp, "questions.qbank")
+    build_bank(path, sources)
+    bank = QuestionBank(path)
+    try:
+        expect(len(bank) == len(expected), f"{path}: {len(bank)} questions, expected {len(expected)}")
+        seen = set()
+        for i in range(len(bank)):
+            text, correct, wrongs = bank.question(i)
+            expect(text in expected and expected[text][2:] == (correct, wrongs),
+                   f"{path}: question {i} reads back as {text!r}")
+            seen.add(text)
+        expect(len(seen) == len(expected), f"{path}: questions missing or repeated")
+
+        for topic in (None, "sums", "fractions", ""):
+            for difficulty in bank.available(topic):
+                first, count = bank.group(difficulty, topic)
+                for i in range(first, first + count):
+                    d, t, _, _ = expected[bank.question(i)[0]]
+                    expect(d == difficulty and topic in (None, t),
+                           f"{path}: question {i} is outside group {topic!r}/d{difficulty}")
+
+        for _, _, wrongs in islice(bank.levels(rng, "fractions", wrong_count=main.WRONG_ANSWERS), 50):
+            expect(len(wrongs) <= main.WRONG_ANSWERS, f"{path}: level with {len(wrongs)} wrong answers")
+
+        check_replay(tmp, seed, ticks, bank, "fractions")
+    finally:
+        bank.close()
+
+
+def check_bundle(tmp, seed, ticks):
+    rng = random.Random(seed)
+    pygame.mixer.init()
+    try:
+        images = {}
+        surfaces = {}
+        for name, flags in (("alpha", pygame.SRCALPHA), ("opaque", 0)):
+            surf = pygame.Surface((37, 23), flags, 32)
+            for x in range(surf.get_width()):
+                for y in range(surf.get_height()):
+                    surf.set_at((x, y), [rng.randrange(256) for _ in range(4)])
+            images[name] = os.path.join(tmp, f"{name}.png")
+            pygame.image.save(surf, images[name])
+            surfaces[name] = pygame.image.load(images[name])
+        # PCM in the mixer's own format, so the bundle stores it unchanged
+        frequency, size, channels = pygame.mixer.get_init()
+        frame = abs(size) // 8 * channels
+        pcm = bytes(rng.randrange(256) for _ in range(frame * 2000))
+        sound_path = os.path.join(tmp, "beep.wav")
+        with wave.open(sound_path, "wb") as f:
+            f.setnchannels(channels)
+            f.setsampwidth(abs(size) // 8)
+            f.setframerate(frequency)
+            f.writeframes(pcm)
+
+        path = os.path.join(tmp, "assets.bundle")
+        build_bundle(path, images, {"beep": sound_path})
+        bundle = Bundle(path)
+        for name, surf in surfaces.items():
+            # The padding byte of an RGBX surface reads back as anything; compare RGB
+            fmt = "RGBA" if bundle.index[name]["format"] == "BGRA" else "RGB"
+            got = pygame.image.tobytes(bundle.image(name), fmt)
+            expect(got == pygame.image.tobytes(surf, fmt), f"{path}: image {name} differs")
+        expect(bundle.sound("beep").get_raw() == pcm, f"{path}: sound beep differs")
+    finally:
+        pygame.mixer.quit()
+
+
+CHECKS = {"replay": check_replay, "qbank": check_qbank, "bundle": check_bundle}
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("checks", nargs="*", metavar="check", help=f"any of {', '.join(CHECKS)} (default: all)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--seconds", type=float, default=60.0, help="length of each recorded session")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown check {unknown[0]!r}")
+    ticks = round(args.seconds * main.SIM_HZ)
+    for name in args.checks or CHECKS:
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory(prefix="math-runner-") as tmp:
+            try:
+                CHECKS[name](tmp, args.seed, ticks)
+            except CheckFailed as e:
+                print(f"{name}: FAILED: {e}")
+                raise SystemExit(1)
+        print(f"{name}: ok ({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,181 @@
+"""Per-answer gameplay telemetry, written to rotating gzip JSONL files.
+
+    python telemetry.py summary telemetry/
+
+The game thread calls TelemetryLog.game_events() after each simulation
+step. It turns the answer-related GameEvents into plain dicts and pushes
+them into a RingBuffer, and that is all it does: no encoding and no I/O.
+A daemon thread drains the buffer every FLUSH_SECONDS, encodes the records
+as JSON lines and appends them to the current file as one gzip member. A
+crash therefore loses at most the member being written. Once a file passes
+MAX_FILE_BYTES the next flush starts a new one.
+
+read_events() streams the records back out of a directory of these files
+for offline aggregation; `summary` is a small example of that.
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict
+
+RING_CAPACITY = 4096
+FLUSH_SECONDS = 1.0
+MAX_FILE_BYTES = 4 * 1024 * 1024
+COMPRESS_LEVEL = 6
+
+# GameEvent kinds that are logged; "wrong" and "timeout" also log a life_lost
+LOGGED_KINDS = ("correct", "wrong", "coin", "timeout", "game_over", "win")
+
+
+class RingBuffer:
+    # Single producer (game thread), single consumer (flush thread). Each side
+    # only ever advances its own index, and list item assignment is atomic, so
+    # neither side takes a lock. When full, new items are dropped and counted.
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.head = 0  # next slot to write; only push() changes it
+        self.tail = 0  # next slot to read; only drain() changes it
+        self.dropped = 0
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def push(self, item):
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.dropped += 1
+            return False
+        self.slots[head % self.capacity] = item
+        self.head = head + 1  # publish only after the slot is filled
+        return True
+
+    def drain(self):
+        head = self.head
+        slots, capacity = self.slots, self.capacity
+        items = []
+        for i in range(self.tail, head):
+            items.append(slots[i % capacity])
+            slots[i % capacity] = None
+        self.tail = head
+        return items
+
+
+class TelemetryLog:
+    def __init__(self, directory, prefix="telemetry", max_bytes=MAX_FILE_BYTES,
+                 flush_seconds=FLUSH_SECONDS, capacity=RING_CAPACITY):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.flush_seconds = flush_seconds
+        self.ring = RingBuffer(capacity)
+        self.files = []  # paths written so far
+        self.written = 0
+        self.stop = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name="telemetry-writer", daemon=True)
+        self.thread.start()
+
+    def record(self, kind, **fields):
+        fields["kind"] = kind
+        fields["t"] = time.time()
+        self.ring.push(fields)
+
+    def game_events(self, events, session, mode, level, equation, answer_time, level_time,
+                    lives, score):
+        # events: one step's GameEvents; the rest describes the level they happened in
+        for ev in events:
+            kind = ev.kind
+            if kind not in LOGGED_KINDS:
+                continue
+            if kind == "timeout":
+                answer_time = level_time
+            self.record(kind, session=session, mode=mode, level=level, equation=equation,
+                        value=ev.value, answer_time=round(answer_time, 3), combo=ev.combo,
+                        points=ev.points, lives=lives, score=score)
+            if kind in ("wrong", "timeout"):
+                self.record("life_lost", session=session, mode=mode, level=level,
+                            equation=equation, lives=lives, cause=kind)
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+    def _run(self):
+        f = None
+        index = 0
+        while True:
+            stopping = self.stop.wait(self.flush_seconds)
+            items = self.ring.drain()
+            if items:
+                if f is None or f.tell() >= self.max_bytes:
+                    if f is not None:
+                        f.close()
+                    index += 1
+                    path = os.path.join(self.directory, f"{self.prefix}-{time.strftime('%Y%m%d-%H%M%S')}"
+                                                        f"-{os.getpid()}-{index:03d}.jsonl.gz")
+                    f = open(path, "wb")
+                    self.files.append(path)
+                lines = "".join(json.dumps(item, separators=(",", ":")) + "\n" for item in items)
+                f.write(gzip.compress(lines.encode(), COMPRESS_LEVEL))
+                f.flush()
+                self.written += len(items)
+            if stopping:
+                break
+        if f is not None:
+            f.close()
+
+
+def read_events(path):
+    # Every record in a file, or in all telemetry files under a directory, oldest file first.
+    # A member cut short by a crash ends that file instead of raising.
+    paths = sorted(glob.glob(os.path.join(path, "*.jsonl.gz"))) if os.path.isdir(path) else [path]
+    for p in paths:
+        try:
+            with gzip.open(p, "rt") as f:
+                for line in f:
+                    yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError):
+            continue
+
+
+def summarize(events):
+    # Per (mode, level): answers, accuracy, median time to answer, timeouts
+    levels = defaultdict(lambda: {"correct": 0, "wrong": 0, "timeout": 0, "times": []})
+    sessions = set()
+    for ev in events:
+        sessions.add(ev.get("session"))
+        if ev["kind"] in ("correct", "wrong", "timeout"):
+            row = levels[(ev["mode"], ev["level"])]
+            row[ev["kind"]] += 1
+            if ev["kind"] != "timeout":
+                row["times"].append(ev["answer_time"])
+    return sessions, levels
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summary", help="accuracy and answer times per level")
+    summary.add_argument("path", help="a telemetry file or a directory of them")
+    args = parser.parse_args(argv)
+
+    if args.command == "summary":
+        sessions, levels = summarize(read_events(args.path))
+        print(f"{len(sessions)} sessions")
+        print(f"{'mode':<8}{'level':>6}{'answers':>9}{'correct':>9}{'timeouts':>10}{'median s':>10}")
+        for (mode, level), row in sorted(levels.items()):
+            answers = row["correct"] + row["wrong"]
+            times = sorted(row["times"])
+            median = times[len(times) // 2] if times else 0.0
+            accuracy = row["correct"] / answers if answers else 0.0
+            print(f"{mode:<8}{level:>6}{answers:>9}{accuracy:>9.0%}{row['timeout']:>10}{median:>10.2f}")
+
+
+if __name__ == "__main__":
+    main_cli()